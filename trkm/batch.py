@@ -0,0 +1,87 @@
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+import traceback
+
+
+def run_job(options, multiplier, writer):
+    """Runs one merge in a worker process, returning (ok, seconds, error)
+    instead of raising, so one bad file cannot take the batch down.
+    """
+    from .trkm import TrackMerge
+    start = time.time()
+    try:
+        # The writers and the zipper talk to stdout, keep that out of the
+        # batch report
+        with contextlib.redirect_stdout(io.StringIO()):
+            TrackMerge(options, multiplier).merge(writer, options.output_file)
+        return (True, time.time() - start, None)
+    except (Exception, SystemExit):
+        return (False, time.time() - start, traceback.format_exc())
+
+
+class Batch:
+    """Runs the merges listed in a manifest file in a process pool.
+
+    Each line of the manifest names the output file followed by its input
+    files, separated by whitespace. Empty lines and lines starting with #
+    are skipped, relative paths are taken relative to the manifest.
+    """
+    def __init__(self, options, multiplier, writer):
+        self.options = options
+        self.multiplier = multiplier
+        self.writer = writer
+
+    def read_manifest(self, file_name):
+        base = os.path.dirname(file_name)
+        jobs = []
+        with open(file_name) as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                paths = [ os.path.join(base, p) for p in line.split() ]
+                jobs.append((paths[0], paths[1:]))
+        return jobs
+
+    def job_options(self, output_file, input_files):
+        options = argparse.Namespace(**vars(self.options))
+        options.output_file = output_file
+        options.input_files = input_files
+        options.progress = False
+        # Reports cover the batch itself, not what each worker did
+        options.timings = False
+        options.stats = None
+        options.profile = None
+        # The pool is already busy, keep each merge in its own process
+        options.jobs = None
+        return options
+
+    def run(self, file_name):
+        """Returns the number of failed jobs."""
+        import concurrent.futures
+        jobs = self.read_manifest(file_name)
+        failed = 0
+        start = time.time()
+        with concurrent.futures.ProcessPoolExecutor(max_workers=self.options.jobs) as pool:
+            futures = {}
+            for (output_file, input_files) in jobs:
+                f = pool.submit(run_job, self.job_options(output_file, input_files),
+                                self.multiplier, self.writer)
+                futures[f] = output_file
+            for f in concurrent.futures.as_completed(futures):
+                try:
+                    (ok, elapsed, error) = f.result()
+                except Exception as e:
+                    (ok, elapsed, error) = (False, 0, "%s\n" % e)
+                if ok:
+                    print("ok      %8.2fs  %s" % (elapsed, futures[f]))
+                else:
+                    failed += 1
+                    print("FAILED  %8.2fs  %s\n%s" % (elapsed, futures[f], error), end="")
+                sys.stdout.flush()
+        print("%d jobs, %d failed, %.2fs" % (len(jobs), failed, time.time() - start))
+        return failed
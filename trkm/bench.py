@@ -0,0 +1,242 @@
+"""Benchmarks merges of synthetic rides made by the Faker generator.
+
+    python -m trkm.bench --lengths 1,6 --devices 1,4 --save baseline.json
+    python -m trkm.bench --lengths 1,6 --devices 1,4 --baseline baseline.json
+
+Every ride is recorded by a number of simulated Faker devices, each
+sampling at its own interval with its own clock offset, noise, missing
+channels and dropouts. The devices are written as track files and merged
+by TrackMerge, timing each stage. Results can be saved as a baseline,
+later runs are compared to it and regressions beyond a threshold are
+reported.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+from datetime import datetime, timedelta, timezone
+from .instrument import stats
+from .trkm import TrackMerge, GPXWriter, TCXWriter
+
+RIDE = """[training]
+cadence = 60, 100
+speed = 15, 45
+time = %s, %s
+base_heart_rate = 70
+heart_rate = 110, 170
+hr_effect_lasting = 30
+hr_effect_delay = 10
+pauses = %s
+distance = %d
+position = 46.05, 14.5
+"""
+
+DEVICE = """
+[device device%d]
+interval = %d
+clock_offset = %d
+gps_noise = 3
+missing = %s
+distance_error = %.1f
+dropouts = %d
+dropout_length = %s
+"""
+
+WRITERS = { 'GPX': GPXWriter, 'TCX': TCXWriter }
+# Sampling interval in seconds of each device, repeating
+INTERVALS = (1, 2, 1, 5)
+# Number of dropouts per hour and their length range in seconds
+DROPOUTS = {
+    'none': (0, "10, 120"),
+    'short': (18, "2, 20"),
+    'long': (1, "120, 600"),
+}
+
+
+class Bench:
+    def __init__(self, args):
+        self.args = args
+        self.directory = None
+        self.rides = {}
+
+    def ride(self, hours, devices, dropout):
+        """Track files of the ride recorded by the devices, generated once.
+        The ride itself only depends on its length and the seed.
+        """
+        from . import sequencer
+        key = (hours, devices, dropout)
+        if key not in self.rides:
+            name = os.path.join(self.directory, "ride-%dh-%ddev-%s.ini" % key)
+            start = datetime(2020, 5, 1, 6, tzinfo=timezone.utc)
+            end = start + timedelta(hours=hours)
+            fmt = '%Y-%m-%d %H:%M:%S%z'
+            (count, length) = DROPOUTS[dropout]
+            with open(name, 'w') as f:
+                f.write(RIDE % (start.strftime(fmt), end.strftime(fmt),
+                                ", ".join([ "120" ] * hours), 25 * hours))
+                for k in range(devices):
+                    # Every fourth device has no heart rate strap
+                    f.write(DEVICE % (k, INTERVALS[k % len(INTERVALS)], k % 3,
+                                      "hr" if k % 4 == 3 else "", 0.2 * k,
+                                      count * hours, length))
+            faker = sequencer.Faker(name, random.Random(self.args.seed))
+            files = []
+            for (k, dev) in zip(faker.device_names(), faker.devices()):
+                file_name = os.path.join(self.directory, "ride-%dh-%ddev-%s-%s.trk"
+                                         % (hours, devices, dropout, k))
+                sequencer.TrackFile.write(file_name, dev)
+                files.append(file_name)
+            self.rides[key] = files
+        return self.rides[key]
+
+    def options(self, files, output_file, engine):
+        return argparse.Namespace(
+            input_files=files, output_file=output_file, engine=engine, rate=None,
+            cleanup=False, cleanup_opts=[], cache=False, cache_dir=None,
+            cache_size=1024, jobs=None, verbose=False, progress=False)
+
+    def run_case(self, hours, devices, dropout, engine, fmt):
+        files = self.ride(hours, devices, dropout)
+        output_file = os.path.join(self.directory, "merged." + fmt.lower())
+        options = self.options(files, output_file, engine)
+        best = None
+        for _ in range(self.args.repeat):
+            stats.reset()
+            # The writers and the zipper talk to stdout
+            with contextlib.redirect_stdout(io.StringIO()):
+                TrackMerge(options).merge(WRITERS[fmt])
+            result = stats.as_dict()
+            result = {
+                'seconds': result['seconds'],
+                'points': stats.get("read").points_out,
+                'peak_rss': result['peak_rss'],
+                'stages': dict((s['name'], s['self_seconds'])
+                               for s in result['stages']),
+            }
+            if best is None or result['seconds'] < best['seconds']:
+                best = result
+        return best
+
+    def cases(self):
+        for hours in self.args.lengths:
+            for devices in self.args.devices:
+                for dropout in self.args.dropouts:
+                    for engine in self.args.engines:
+                        for fmt in self.args.formats:
+                            yield ("%dh-%ddev-%s-%s-%s"
+                                   % (hours, devices, dropout, engine, fmt.lower()),
+                                   (hours, devices, dropout, engine, fmt))
+
+    def run(self):
+        stats.enabled = True
+        self.directory = tempfile.mkdtemp(prefix="trkm-bench-")
+        results = {}
+        try:
+            for (case, params) in self.cases():
+                r = self.run_case(*params)
+                results[case] = r
+                print("%-32s %8d points %8.3fs  %s"
+                      % (case, r['points'], r['seconds'],
+                         " ".join("%s=%.3f" % (k, v) for (k, v) in r['stages'].items()
+                                  if k != "import sequencer")))
+                sys.stdout.flush()
+        finally:
+            shutil.rmtree(self.directory, ignore_errors=True)
+        return results
+
+    def compare(self, results, baseline):
+        """Returns the regressions as (case, what, old, new) tuples."""
+        regressions = []
+        for (case, r) in results.items():
+            b = baseline['cases'].get(case)
+            if b is None:
+                continue
+            pairs = [ ("total", b['seconds'], r['seconds']) ]
+            pairs += [ (k, b['stages'][k], v) for (k, v) in r['stages'].items()
+                       if k in b['stages'] and k != "import sequencer" ]
+            for (what, old, new) in pairs:
+                if (new > old * (1 + self.args.threshold)
+                    and new - old > self.args.min_delta):
+                    regressions.append((case, what, old, new))
+        return regressions
+
+    def main():
+        def numbers(s):
+            return [ int(v) for v in s.split(',') ]
+        def names(s):
+            return [ v.strip() for v in s.split(',') ]
+        parser = argparse.ArgumentParser(
+            prog="python -m trkm.bench",
+            description="Benchmark merging synthetic rides recorded by "
+            "several simulated devices")
+        parser.add_argument("--lengths", metavar="HOURS,...", type=numbers,
+                            help="Ride lengths in hours, default 1,6,24",
+                            dest="lengths", default=[1, 6, 24])
+        parser.add_argument("--devices", metavar="N,...", type=numbers,
+                            help="Numbers of devices recording each ride, default 1,2,4,8",
+                            dest="devices", default=[1, 2, 4, 8])
+        parser.add_argument("--dropouts", metavar="PATTERN,...", type=names,
+                            help="Dropout patterns out of %s, default all"
+                            % ", ".join(DROPOUTS),
+                            dest="dropouts", default=list(DROPOUTS))
+        parser.add_argument("--engines", metavar="ENGINE,...", type=names,
+                            help="Merge engines, default grid",
+                            dest="engines", default=["grid"])
+        parser.add_argument("--formats", metavar="FORMAT,...", type=names,
+                            help="Output formats, default GPX,TCX",
+                            dest="formats", default=["GPX", "TCX"])
+        parser.add_argument("--repeat", metavar="N", type=int,
+                            help="Run every case N times and keep the fastest, default 1",
+                            dest="repeat", default=1)
+        parser.add_argument("--seed", metavar="N", type=int,
+                            help="Random seed of the generated rides, default 1",
+                            dest="seed", default=1)
+        parser.add_argument("--save", metavar="FILE",
+                            help="Save the results as a baseline to FILE",
+                            dest="save", default=None)
+        parser.add_argument("--baseline", metavar="FILE",
+                            help="Compare the results to the baseline in FILE",
+                            dest="baseline", default=None)
+        parser.add_argument("--threshold", metavar="FRACTION", type=float,
+                            help="Slowdown reported as a regression, default 0.2",
+                            dest="threshold", default=0.2)
+        parser.add_argument("--min-delta", metavar="SECONDS", type=float,
+                            help="Ignore slowdowns shorter than this, default 0.05",
+                            dest="min_delta", default=0.05)
+        args = parser.parse_args()
+        for v in args.dropouts:
+            if v not in DROPOUTS:
+                parser.error("unknown dropout pattern '%s'" % v)
+        args.formats = [ v.upper() for v in args.formats ]
+        for v in args.formats:
+            if v not in WRITERS:
+                parser.error("unknown format '%s'" % v)
+
+        bench = Bench(args)
+        results = bench.run()
+        if args.save:
+            with open(args.save, 'w') as f:
+                json.dump({ 'python': platform.python_version(),
+                            'machine': platform.machine(),
+                            'cases': results }, f, indent=2, sort_keys=True)
+                f.write("\n")
+        if args.baseline:
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+            regressions = bench.compare(results, baseline)
+            for (case, what, old, new) in regressions:
+                print("REGRESSION %-32s %-12s %8.3fs -> %8.3fs (%+.0f%%)"
+                      % (case, what, old, new, (new / old - 1) * 100 if old else 0))
+            if regressions:
+                sys.exit(1)
+            print("No regressions against %s" % args.baseline)
+
+
+if __name__ == "__main__":
+    Bench.main()
@@ -0,0 +1,117 @@
+"""Generates synthetic rides in bulk from a Faker .ini template.
+
+    python -m trkm.generate ride.ini --count 1000 --seed 42 --format TCX -o rides/
+
+Every ride draws from its own random generator, seeded from the seed and
+the ride number, so any ride can be reproduced on its own and the rides
+can be generated in parallel processes.
+"""
+import argparse
+import concurrent.futures
+import contextlib
+import io
+import os
+import random
+import sys
+import time
+import traceback
+from .trkm import GPXWriter, TCXWriter, TRKWriter
+
+WRITERS = { 'GPX': GPXWriter, 'TCX': TCXWriter, 'TRK': TRKWriter }
+
+
+def ride_random(seed, index):
+    return random.Random("trkm-ride-%d-%d" % (seed, index))
+
+
+def generate_ride(template, seed, index, output_file, writer):
+    """Generates and writes one ride in a worker process, returning
+    (ok, error) instead of raising. A template with devices gets a file
+    per device, named after it.
+    """
+    from . import sequencer
+    try:
+        faker = sequencer.Faker(template, ride_random(seed, index))
+        tracks = faker.devices()
+        names = faker.device_names()
+        if names:
+            (base, ext) = os.path.splitext(output_file)
+            files = [ "%s-%s%s" % (base, name, ext) for name in names ]
+        else:
+            files = [ output_file ]
+        options = argparse.Namespace(progress=False)
+        # The GPX writer reports the point count on stdout
+        with contextlib.redirect_stdout(io.StringIO()):
+            for (columns, file_name) in zip(tracks, files):
+                writer(columns, options).write(file_name)
+        return (True, None)
+    except (Exception, SystemExit):
+        return (False, traceback.format_exc())
+
+
+class Generator:
+    def __init__(self, template, count, seed, writer, directory):
+        self.template = template
+        self.count = count
+        self.seed = seed
+        self.writer = writer
+        self.directory = directory
+
+    def output_file(self, index, ext):
+        stem = os.path.splitext(os.path.basename(self.template))[0]
+        return os.path.join(self.directory, "%s-%05d.%s" % (stem, index, ext))
+
+    def run(self, jobs=None, ext='gpx'):
+        """Returns the number of rides that failed."""
+        os.makedirs(self.directory, exist_ok=True)
+        n = self.count
+        failed = 0
+        start = time.time()
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+            results = pool.map(generate_ride, [ self.template ] * n, [ self.seed ] * n,
+                               range(n), [ self.output_file(i, ext) for i in range(n) ],
+                               [ self.writer ] * n,
+                               chunksize=max(1, min(64, n // (4 * (jobs or os.cpu_count() or 1)))))
+            for (i, (ok, error)) in enumerate(results):
+                if not ok:
+                    failed += 1
+                    print("FAILED  %s\n%s" % (self.output_file(i, ext), error), end="")
+        print("%d rides, %d failed, %.2fs" % (n, failed, time.time() - start))
+        return failed
+
+    def main():
+        parser = argparse.ArgumentParser(
+            prog="python -m trkm.generate",
+            description="Generate synthetic rides from a Faker .ini template")
+        parser.add_argument("template", metavar="TEMPLATE.ini",
+                            help="Ride description, the [training] and [device NAME] "
+                            "sections Faker reads")
+        parser.add_argument("-n", "--count", metavar="N", type=int,
+                            help="Number of rides to generate, default 1",
+                            dest="count", default=1)
+        parser.add_argument("-s", "--seed", metavar="N", type=int,
+                            help="Seed the rides are derived from, default 0",
+                            dest="seed", default=0)
+        parser.add_argument("-f", "--format", metavar="FORMAT",
+                            help="Output file format, may be GPX, TCX or TRK",
+                            dest="format", default="GPX")
+        parser.add_argument("-o", "--output-dir", metavar="DIR",
+                            help="Directory to write the rides into, default .",
+                            dest="directory", default=".")
+        parser.add_argument("-j", "--jobs", metavar="N", type=int,
+                            help="Number of worker processes, defaults to the number "
+                            "of CPUs",
+                            dest="jobs", default=None)
+        args = parser.parse_args()
+        fmt = args.format.upper()
+        if fmt not in WRITERS:
+            parser.error("format '%s' not recognized" % args.format)
+        if not os.path.exists(args.template):
+            parser.error("%s not found" % args.template)
+        g = Generator(args.template, args.count, args.seed, WRITERS[fmt], args.directory)
+        if g.run(args.jobs, fmt.lower()):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    Generator.main()
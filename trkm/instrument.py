@@ -0,0 +1,231 @@
+import contextlib
+import json
+import os
+import sys
+import time
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def peak_rss():
+    """Peak resident set size of the process in bytes, None if unknown."""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+class Stage:
+    """What one pipeline stage did: time spent in it, including and
+    excluding the stages it pulled from, points in and out, and the peak
+    RSS of the process the last time the stage finished.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.seconds = 0.0
+        self.inner = 0.0
+        self.points_in = None
+        self.points_out = None
+        self.peak_rss = None
+        self.counters = {}
+        self.profile = None
+
+    def as_dict(self):
+        return {
+            'name': self.name,
+            'calls': self.calls,
+            'seconds': self.seconds,
+            'self_seconds': self.seconds - self.inner,
+            'points_in': self.points_in,
+            'points_out': self.points_out,
+            'peak_rss': self.peak_rss,
+            'counters': self.counters,
+        }
+
+
+class Probe:
+    """Iterates over a lazy stage, timing every step as that stage and
+    counting the points coming out. Other attributes are passed through.
+
+    Points computing their fields only when asked, like the Zipper's, get
+    the given fields resolved within the step, so the work is not charged
+    to whatever reads them next.
+    """
+    def __init__(self, stats, stage, seq, fields=()):
+        self._stats = stats
+        self._stage = stage
+        self._seq = seq
+        self._fields = fields
+        self._it = None
+        stage.points_out = 0
+
+    def __getattr__(self, key):
+        return getattr(self._seq, key)
+
+    def __iter__(self):
+        self._stats.enter(self._stage)
+        try:
+            self._it = iter(self._seq)
+        finally:
+            self._stats.leave(self._stage, False)
+        return self
+
+    def __next__(self):
+        if self._it is None:
+            iter(self)
+        self._stats.enter(self._stage)
+        try:
+            v = next(self._it)
+            for key in self._fields:
+                getattr(v, key)
+        except StopIteration:
+            self._stage.peak_rss = peak_rss()
+            raise
+        finally:
+            self._stats.leave(self._stage, False)
+        self._stage.points_out += 1
+        return v
+
+
+class Timed:
+    """Times every method call and lookup on an object that is driven by
+    index rather than iteration, like an Interpolator under the Zipper.
+    """
+    def __init__(self, stats, stage, obj):
+        self._stats = stats
+        self._stage = stage
+        self._obj = obj
+
+    def __getattr__(self, key):
+        v = getattr(self._obj, key)
+        if not callable(v):
+            return v
+        def timed(*args, **kwargs):
+            self._stats.enter(self._stage)
+            try:
+                return v(*args, **kwargs)
+            finally:
+                self._stats.leave(self._stage, False)
+        return timed
+
+    def __getitem__(self, k):
+        self._stats.enter(self._stage)
+        try:
+            return self._obj[k]
+        finally:
+            self._stats.leave(self._stage, False)
+
+
+class Stats:
+    """Stage statistics for --timings, --stats and --profile.
+
+    Stages may nest, a stage pulling points from a lazy one is charged
+    only for its own time in self_seconds. With profiling on, each stage
+    has its own cProfile.Profile, running only while that stage is the
+    innermost one.
+
+    Plain stages are always timed, that costs next to nothing. Probes and
+    timed objects cost something on every point, so probe() and timed()
+    only wrap when enabled.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.profiling = False
+        self.reset()
+
+    def reset(self):
+        self.start = time.perf_counter()
+        self.stages = {}
+        self.active = []
+
+    def get(self, name):
+        if name not in self.stages:
+            self.stages[name] = Stage(name)
+        return self.stages[name]
+
+    def enter(self, stage):
+        if self.profiling:
+            if self.active:
+                self.active[-1][0].profile.disable()
+            if stage.profile is None:
+                import cProfile
+                stage.profile = cProfile.Profile()
+            stage.profile.enable()
+        stage.calls += 1
+        self.active.append((stage, time.perf_counter()))
+
+    def leave(self, stage, sample=True):
+        (top, start) = self.active.pop()
+        elapsed = time.perf_counter() - start
+        # Reentered stages are accounted for by their outermost call
+        if all(s is not stage for (s, _) in self.active):
+            stage.seconds += elapsed
+            if self.active:
+                self.active[-1][0].inner += elapsed
+        if sample:
+            stage.peak_rss = peak_rss()
+        if self.profiling:
+            stage.profile.disable()
+            if self.active:
+                self.active[-1][0].profile.enable()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        stage = self.get(name)
+        self.enter(stage)
+        try:
+            yield stage
+        finally:
+            self.leave(stage)
+
+    def probe(self, name, seq, fields=()):
+        if not self.enabled:
+            return seq
+        return Probe(self, self.get(name), seq, fields)
+
+    def timed(self, name, obj):
+        if not self.enabled:
+            return obj
+        return Timed(self, self.get(name), obj)
+
+    def as_dict(self):
+        return {
+            'argv': sys.argv[1:],
+            'seconds': time.perf_counter() - self.start,
+            'peak_rss': peak_rss(),
+            'stages': [ s.as_dict() for s in self.stages.values() ],
+        }
+
+    def write(self, file_name):
+        with open(file_name, 'w') as f:
+            json.dump(self.as_dict(), f, indent=2)
+            f.write("\n")
+
+    def dump_profiles(self, directory):
+        """Writes a pstats file per profiled stage into directory."""
+        os.makedirs(directory, exist_ok=True)
+        for s in self.stages.values():
+            if s.profile is not None:
+                s.profile.dump_stats(os.path.join(directory, "%s.pstats"
+                                                  % s.name.replace(" ", "-")))
+
+    def report(self, file=sys.stderr):
+        def opt(v, fmt):
+            return "-" if v is None else fmt % v
+        print("%-18s %6s %9s %9s %9s %9s %8s" % ("Stage", "calls", "seconds", "self",
+                                                 "in", "out", "RSS MB"), file=file)
+        for s in self.stages.values():
+            print("%-18s %6d %9.3f %9.3f %9s %9s %8s"
+                  % (s.name, s.calls, s.seconds, s.seconds - s.inner,
+                     opt(s.points_in, "%d"), opt(s.points_out, "%d"),
+                     opt(s.peak_rss and s.peak_rss / 1024 / 1024, "%.1f")), file=file)
+            for (k, v) in sorted(s.counters.items()):
+                print("    %-20s %d" % (k, v), file=file)
+        print("%-18s %6s %9.3f" % ("total", "", time.perf_counter() - self.start), file=file)
+
+
+stats = Stats()
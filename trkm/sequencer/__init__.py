@@ -1,6 +1,10 @@
 
 from .activityio import AIO
+from .columns import Columns, FIELDS
 from .faker import Faker
 from .interpolator import Interpolator
-from .zipper import Zipper
+from .zipper import Zipper, GridZipper
 from .cleanup import Cleanup
+from .reader import read
+from .cache import Cache
+from .trackfile import TrackFile
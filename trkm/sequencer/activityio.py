@@ -1,6 +1,7 @@
-
-import activityio as aio
 import math
+import numpy as np
+from .columns import Columns, epoch
+from ..instrument import stats
 
 class AIOWrapper:
     def __init__(self, name, df, idx, last=None):
@@ -87,11 +88,58 @@ class AIOWrapper:
 
 
 class AIO:
-    def __init__(self, name, df):
+    def __init__(self, name, df, columnar=False):
         self.name = name
         self._df = df
+        self.columnar = columnar
+        self._columns = None
+
+    def open(name):
+        """Reads a track file with activityio, in columnar mode."""
+        # activityio pulls in pandas, only pay for it when it is needed
+        with stats.stage("import activityio"):
+            import activityio as aio
+        seq = AIO(name, None, columnar=True)
+        seq._columns = AIO(name, aio.read(name)).columns()
+        return seq
+
+    def column(self, *names):
+        for name in names:
+            if name in self._df.columns:
+                return np.asarray(self._df[name].values, dtype=float)[1:]
+        return None
+
+    def columns(self):
+        """Pulls all known fields out of the DataFrame at once, dropping
+        the same rows all() would skip.
+        """
+        if self._columns is not None:
+            return self._columns
+        start = self._df.start
+        time = epoch(start) + np.asarray(self._df.index.total_seconds(), dtype=float)[1:]
+        dist = self.column('dist')
+        if dist is None:
+            dist = np.zeros(len(time))
+        keep = time >= np.maximum.accumulate(time)
+        fields = {
+            'lat': self.column('lat'),
+            'lon': self.column('lon'),
+            'alt': self.column('alt'),
+            'distance': dist,
+            'speed': self.column('speed'),
+            'hr': self.column('hr', 'value'),
+            'cadence': self.column('cad'),
+            'temperature': self.column('temp'),
+        }
+        for (key, v) in fields.items():
+            if v is not None:
+                fields[key] = v[keep]
+        return Columns(self.name, time[keep], tzinfo=start.tzinfo, **fields)
 
     def all(self):
+        if self.columnar:
+            yield from self.columns()
+            return
         last = None
         for idx in range(1, self._df.shape[0]):
             v = AIOWrapper(self.name, self._df, idx, last)
@@ -0,0 +1,105 @@
+import hashlib
+import math
+import os
+import tempfile
+import time
+from datetime import timedelta, timezone
+import numpy as np
+from .columns import Columns, FIELDS
+
+# Bump whenever a reader starts producing different columns for the same
+# file, so stale entries stop matching
+READER_VERSION = 3
+# Seconds after which a .tmp file is taken for a crashed writer's
+TMP_MAX_AGE = 3600
+
+
+class Cache:
+    """Parsed tracks stored as compressed .npz files, keyed by a hash of
+    the file content and READER_VERSION.
+
+    Entries are touched on every hit and the least recently used ones are
+    removed once the directory grows beyond max_size bytes.
+    """
+    def __init__(self, directory=None, max_size=1024*1024*1024):
+        self.directory = directory or os.path.join(
+            os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+            'trkm')
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, file_name):
+        h = hashlib.sha256(b"trkm-reader-%d\0" % READER_VERSION)
+        with open(file_name, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024*1024), b''):
+                h.update(chunk)
+        return h.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.npz')
+
+    def load(self, key, name):
+        path = self.path(key)
+        try:
+            with np.load(path) as data:
+                offset = float(data['tzoffset'])
+                if math.isnan(offset):
+                    tzinfo = None
+                else:
+                    tzinfo = timezone(timedelta(seconds=offset))
+                fields = dict((field, data[field]) for field in FIELDS)
+                columns = Columns(name, data['time'], tzinfo=tzinfo, **fields)
+            os.utime(path)
+        except (OSError, KeyError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return columns
+
+    def store(self, key, columns):
+        """Stores the columns if it can, a cache that cannot be written to
+        only means the file gets parsed again next time.
+        """
+        offset = columns.utcoffset()
+        fields = dict((field, getattr(columns, field)) for field in FIELDS)
+        tmp = None
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            (fd, tmp) = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                np.savez_compressed(f, time=columns.time, tzoffset=offset, **fields)
+            os.replace(tmp, self.path(key))
+            self.evict()
+        except OSError:
+            if tmp is not None:
+                try:
+                    os.unlink(tmp)
+                except OSError:
+                    pass
+
+    def evict(self):
+        entries = []
+        now = time.time()
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+                # Left behind by a writer that crashed, others may still
+                # be writing theirs
+                if name.endswith('.tmp') and now - st.st_mtime > TMP_MAX_AGE:
+                    os.remove(path)
+                    continue
+            except FileNotFoundError:
+                continue
+            if name.endswith('.npz'):
+                entries.append((st.st_mtime, st.st_size, name))
+        total = sum(e[1] for e in entries)
+        for (_, size, name) in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            total -= size
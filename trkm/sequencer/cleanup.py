@@ -1,7 +1,9 @@
 import configparser
 import sys
+import math
 from datetime import datetime, timedelta
-import statistics, random
+import random
+import numpy as np
 
 
 # class RecordWrapper:
@@ -53,15 +55,102 @@ class RecordWrapper:
         self.override[key] = value
 
 
+class Window:
+    """The most recent records of a stream, still addressed by their index
+    in the whole stream. Records before start are gone.
+    """
+    def __init__(self):
+        self.records = []
+        self.head = 0
+        self.start = 0
+
+    def append(self, r):
+        self.records.append(r)
+
+    def popleft(self):
+        r = self.records[self.head]
+        self.head += 1
+        self.start += 1
+        if self.head > len(self.records) // 2:
+            del self.records[:self.head]
+            self.head = 0
+        return r
+
+    def size(self):
+        return len(self.records) - self.head
+
+    def __len__(self):
+        return self.start + self.size()
+
+    def __getitem__(self, i):
+        if i < self.start or i >= len(self):
+            raise IndexError(i)
+        return self.records[self.head + i - self.start]
+
+
+class SpeedByCadence:
+    """Mean and standard deviation of speed to cadence ratios around a
+    record, over the nearest valid samples before and after it.
+
+    The valid samples are found once, so every estimate only looks at the
+    samples it uses. Cadence changes made while cleaning up are passed in
+    with set_cadence().
+    """
+    def __init__(self, first, spd, cadence, max_speed):
+        self.first = first
+        self.spd = np.asarray(spd, dtype=float)
+        self.cadence = np.array(cadence, dtype=float)
+        usable = (self.cadence != 0) & (self.spd <= max_speed)
+        self.after = np.flatnonzero(usable)
+        self.before = np.flatnonzero(usable & (self.spd > 0))
+
+    def set_cadence(self, i, cadence):
+        self.cadence[i - self.first] = cadence
+
+    def estimate(self, start, cnt_before, cnt_after):
+        j = start - self.first
+        lst = []
+        k = np.searchsorted(self.before, j, side='right') - 1
+        while k >= 0 and len(lst) < cnt_before:
+            p = self.before[k]
+            if self.cadence[p] != 0:
+                lst.append(self.spd[p] / self.cadence[p])
+            k -= 1
+        k = np.searchsorted(self.after, j, side='right')
+        for p in self.after[k:k+cnt_after]:
+            lst.append(self.spd[p] / self.cadence[p])
+        if not lst:
+            return (0, 0)
+        mean = math.fsum(lst) / len(lst)
+        if len(lst) < 2:
+            return (mean, 0)
+        var = math.fsum((v - mean) ** 2 for v in lst) / (len(lst) - 1)
+        return (mean, math.sqrt(var))
+
+
 class Cleanup:
+    # Settled records handed out at once when streaming
+    BATCH = 64
+
     def __init__(self, sequencer, options):
         self.options = options
         self.sequencer = sequencer
         self.max_speed = options.get_float("MaxSpeed") or 50
+        self.window = options.get_int("Window")
+        # Lowest index whose predecessor is still around, and lowest
+        # index that has not been handed out yet
+        self.first_read = 0
+        self.first_write = 0
+        self.ratio = None
+        self.ratio_span = None
+        self.overflow = False
 
     def __iter__(self):
+        if self.window:
+            return self.stream()
         #self.seq = iter(self.sequencer)
         self.seq = list(self.sequencer)
+        self.start_time = self.seq[0].time if self.seq else None
         self.idx = 0
         self.last_r = None
         self.distance_diff_accumulated = 0
@@ -84,8 +173,134 @@ class Cleanup:
         # r = self.cleanup(r)
         # return r
 
+    def stream(self):
+        """Cleans up in a bounded window, handing out records in batches
+        once nothing ahead of them can change them any more.
+
+        A pause run is smoothed once the record after it arrives, and a
+        record gets its speed checked once as many usable samples follow
+        it as avg_spd_by_cad looks at. Records leaving the window are
+        forced through, so the output only matches the whole track
+        cleanup as long as the window holds those samples on both sides
+        of every record, and a smoothed pause only reaches back over
+        records not handed out yet.
+        """
+        self.seq = Window()
+        self.start_time = None
+        self.distance = None
+        self.last_time = None
+        batch = max(1, min(Cleanup.BATCH, self.window // 4))
+        start_0 = None
+        for r in self.sequencer:
+            r = self.prepare(r)
+            i = len(self.seq)
+            self.seq.append(r)
+            if self.start_time is None:
+                self.start_time = r.time
+            self.show("Smooth", i)
+            if r.cadence == 0:
+                if start_0 is None:
+                    start_0 = i
+            elif start_0 is not None:
+                self.smooth_pause(max(start_0, self.first_write), i-1)
+                start_0 = None
+
+            smoothed = start_0 if start_0 is not None else i+1
+            # A batch at a time, every flush looks at the samples around it,
+            # but leaving most of the window to the samples records need
+            if smoothed - self.first_write >= batch:
+                settled = self.settled(smoothed)
+                if settled - self.first_write >= batch:
+                    yield from self.flush(settled)
+
+            while self.seq.size() > self.window:
+                if self.first_write < self.seq.start + 2:
+                    yield from self.flush(self.settled(smoothed))
+                if not self.overflow and self.needed(self.seq.start):
+                    self.too_small(self.first_write)
+                yield from self.flush(self.seq.start + 2)
+                self.seq.popleft()
+                self.first_read = self.seq.start + 1
+        yield from self.flush(len(self.seq))
+
+    def too_small(self, i):
+        """Warns, once, that the window cut the cleanup short at record i."""
+        if self.overflow:
+            return
+        self.overflow = True
+        print("Cleanup window of %d records is too small at %s, the result may "
+              "differ from cleaning up the whole track"
+              % (self.window, self.active_time_str(i)), file=sys.stderr)
+
+    def needed(self, i, count=10):
+        """Whether dropping record i changes the cleanup of the records
+        not handed out yet: it is not handed out itself, or one of them
+        would take it as a sample before it.
+        """
+        if i + 2 > self.first_write:
+            return True
+        if not self.usable(i + 1, before=True):
+            return False
+        j = self.first_write
+        while count and j > i + 2:
+            j -= 1
+            if self.usable(j, before=True):
+                count -= 1
+        return count > 0
+
+    def settled(self, end_i, count=10):
+        """Index of the count-th last usable sample before end_i, the
+        records before it have count of them following.
+        """
+        i = end_i
+        while count and i > max(self.first_read, self.first_write):
+            i -= 1
+            if self.usable(i):
+                count -= 1
+        return self.first_write if count else i
+
+    def usable(self, i, before=False):
+        """Whether SpeedByCadence takes record i as a sample after others,
+        or with before, as one before others.
+        """
+        r = self.seq[i]
+        if r.cadence == 0:
+            return False
+        if i == 0:
+            return not before
+        last_r = self.seq[i-1]
+        dd = r.distance - last_r.distance
+        td = (r.time - last_r.time).total_seconds()
+        if td == 0:
+            # Infinite or undefined, like the numpy division gives
+            return dd < 0 and not before
+        spd = dd / td * 60 * 60 / 1000
+        return spd <= self.max_speed and (spd > 0 or not before)
+
+    def flush(self, end_i):
+        """Cleans up and hands out all records before end_i."""
+        if end_i <= self.first_write:
+            return
+        end_i = min(end_i, len(self.seq))
+        self.clean_speed(self.first_write, end_i)
+        for i in range(self.first_write, end_i):
+            yield self.emit(i)
+        self.first_write = end_i
+
+    def emit(self, i):
+        r = self.seq[i]
+        out = RecordWrapper(r)
+        if self.last_time is None:
+            out.distance = r.distance
+        else:
+            t = (r.time - self.last_time).total_seconds()
+            out.distance = self.distance + self.recorded_speed(i) * t / 3600 * 1000
+        self.distance = out.distance
+        self.last_time = r.time
+        return out
+
     def active_time_str(self, i):
-        active_time = self.seq[i].time - self.seq[0].time
+        active_time = self.seq[i].time - self.start_time
         return ("%02d:%02d:%02d"
                 % (active_time.seconds // 3600,
                    (active_time.seconds % 3600) // 60,
@@ -142,29 +357,26 @@ class Cleanup:
         return self.seq[i].cadence
 
     def avg_spd_by_cad(self, start, cnt_before, cnt_after):
-        lst = []
-        i = start
-        n = 0
-        while i >= 0 and n < cnt_before:
-            if self[i].cadence != 0:
-                spd = self.calculated_speed(i)
-                if spd > 0 and spd <= self.max_speed:
-                    lst.append(spd / self[i].cadence)
-                    n += 1
-            i -= 1
-        i = start+1
-        n = 0
-        while i < len(self.seq) and n < cnt_after:
-            if self[i].cadence != 0:
-                spd = self.calculated_speed(i)
-                if spd <= self.max_speed:
-                    lst.append(spd / self[i].cadence)
-                    n += 1
-            i += 1
-        if lst:
-            return (statistics.mean(lst), statistics.stdev(lst))
-        else:
-            return (0, 0)
+        if self.ratio is None:
+            # Only the samples the records being cleaned up can reach,
+            # so streaming does not go over the whole window every time
+            (lo, hi) = self.ratio_span
+            lo = self.reach(lo, -1, cnt_before)
+            hi = self.reach(hi - 1, 1, cnt_after) + 1
+            self.ratio = SpeedByCadence(lo, self.calculated_speeds(lo, hi),
+                                        [ self[i].cadence for i in range(lo, hi) ],
+                                        self.max_speed)
+        return self.ratio.estimate(start, cnt_before, cnt_after)
+
+    def reach(self, i, step, count):
+        """Index of the count-th usable sample from i in the direction of
+        step, or the last record there is that way.
+        """
+        while count and self.first_read <= i + step < len(self.seq):
+            i += step
+            if self.usable(i, before=step < 0):
+                count -= 1
+        return i
 
     def nearby(self, a, b, range=1.0):
         return abs(a - b) < range
@@ -176,15 +388,20 @@ class Cleanup:
         v = round(v, decimals)
         if pct_diff is not None:
             diff = v * (pct_diff / 100)
-        est_start = end_i
-        for i in range(end_i, -1, -1):
+        def same(i):
             if diff is not None:
-                if abs(self.delta_dist(i) - v) > diff:
-                    break
+                return abs(self.delta_dist(i) - v) <= diff
             else:
-                if round(self.delta_dist(i), decimals) != v:
-                    break
+                return round(self.delta_dist(i), decimals) == v
+        est_start = end_i
+        first = max(self.first_read, self.first_write)
+        for i in range(end_i, first - 1, -1):
+            if not same(i):
+                break
             est_start = i
+        if est_start == first > 0 and (first == self.first_read or same(first - 1)):
+            # The whole track would have been smoothed further back
+            self.too_small(first)
         return est_start
 
     def compare_delta_dist(self, v, start_i, end_i, decimals=2, diff=None, pct_diff=None):
@@ -258,63 +475,106 @@ class Cleanup:
                     end_0 = None
 
         for (start_0, end_0) in pause:
+            self.smooth_pause(start_0, end_0)
+
+    def smooth_pause(self, start_0, end_0):
+        if start_0 > end_0:
+            return
+        if self.options.get_bool("verbose"):
+            print("Step: %3d - %3d" % (start_0, end_0))
+        nri = self.next_ri(end_0)
+        delta_dist = self.delta_dist(nri)
+        if self.compare_delta_dist(delta_dist, start_0, end_0, pct_diff=10):
+            start_0 = self.find_estimation_start(delta_dist, start_0, pct_diff=10)
+            if start_0 == 0:
+                start_dist = 0
+                start_t = self[0].time
+            else:
+                start_dist = self[start_0-1].distance
+                start_t = self[start_0-1].time
+
+            if end_0 < len(self.seq):
+                end_dist = self[end_0+1].distance
+                cadence = self[end_0+1].cadence
+                end_t = self[end_0+1].time
+            else:
+                end_dist = self[end_0].distance
+                cadence = self[end_0].cadence
+                end_t = self[end_0].time
+
+            distributable = end_dist - start_dist
+            usable_time = self.usable_time(start_0, end_0)
+            total_time = usable_time #(end_t - start_t).total_seconds()
             if self.options.get_bool("verbose"):
-                print("Step: %3d - %3d" % (start_0, end_0))
-            nri = self.next_ri(end_0)
-            delta_dist = self.delta_dist(nri)
-            if self.compare_delta_dist(delta_dist, start_0, end_0, pct_diff=10):
-                start_0 = self.find_estimation_start(delta_dist, start_0, pct_diff=10)
-                if start_0 == 0:
-                    start_dist = 0
-                    start_t = self[0].time
-                else:
-                    start_dist = self[start_0-1].distance
-                    start_t = self[start_0-1].time
-
-                if end_0 < len(self.seq):
-                    end_dist = self[end_0+1].distance
-                    cadence = self[end_0+1].cadence
-                    end_t = self[end_0+1].time
-                else:
-                    end_dist = self[end_0].distance
-                    cadence = self[end_0].cadence
-                    end_t = self[end_0].time
-
-                distributable = end_dist - start_dist
-                usable_time = self.usable_time(start_0, end_0)
-                total_time = usable_time #(end_t - start_t).total_seconds()
-                if self.options.get_bool("verbose"):
-                    print("  Distribute: %.2f %.2f" % (distributable, usable_time))
-                self.show("    Smoothing", start_0, end_0)
-                self.distribute_distance(start_0, end_0,
-                                         distributable, cadence,
-                                         total_time, usable_time)
-                self.show("    Smoothed", start_0, end_0)
+                print("  Distribute: %.2f %.2f" % (distributable, usable_time))
+            self.show("    Smoothing", start_0, end_0)
+            self.distribute_distance(start_0, end_0,
+                                     distributable, cadence,
+                                     total_time, usable_time)
+            self.show("    Smoothed", start_0, end_0)
 
 
     def cleanup(self, max_step=10):
-        pina = []
-        for i in range(0, len(self.seq)):
-            spd = self.calculated_speed(i)
-            rec_spd = self.recorded_speed(i)
-            if self.time_delta(i) > max_step and self[i].cadence == 0:
-                self.set_recorded_speed(i, 0)
-            elif (spd > self.max_speed or rec_spd > self.max_speed):
-                (avg_cad, var) = self.avg_spd_by_cad(i, 10, 10)
-                mix = random.triangular(-var, var)
-                nc = round(self[i].cadence + self[i].cadence * mix)
-                # print("HUHA %d, %.2f, %.2f, %.2f - ~%.2f, *%.2f, %.2f, %.2f" % (i, avg_cad, self[i].cadence, self[i].cadence * avg_cad, var, mix, nc, nc * avg_cad))
-                self[i].cadence = nc
-                pina.append(nc)
-                self.set_recorded_speed(i, self[i].cadence * avg_cad)
-            else:
-                self.set_recorded_speed(i, max(rec_spd, spd))
+        if not len(self.seq):
+            return
+        (td, speed) = self.clean_speed(0, len(self.seq), max_step)
 
-        distance = self[0].distance
-        for i in range(0, len(self.seq)):
-            t = self.time_delta(i)
-            step = self.recorded_speed(i) * t / 3600 * 1000
-            self[i].distance = distance + step
-            distance = self[i].distance
+        step = speed * 60 * 60 / 1000 * td / 3600 * 1000
+        step[0] += self[0].distance
+        distance = np.cumsum(step)
+        for (r, d) in zip(self.seq, distance.tolist()):
+            r.distance = d
 
         self.show("  Cleaned up", 0, len(self.seq)-1)
+
+    def time_deltas(self, start_i, end_i):
+        first = max(start_i-1, 0)
+        times = [ self[i].time for i in range(first, end_i) ]
+        td = [ (b - a).total_seconds() for (a, b) in zip(times, times[1:]) ]
+        if start_i == 0:
+            td.insert(0, 0)
+        return np.array(td, dtype=float)
+
+    def calculated_speeds(self, start_i, end_i, td=None):
+        if td is None:
+            td = self.time_deltas(start_i, end_i)
+        first = max(start_i-1, 0)
+        dist = np.array([ self[i].distance for i in range(first, end_i) ], dtype=float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            spd = np.diff(dist) / td[-len(dist)+1:] * 60 * 60 / 1000
+        if start_i == 0:
+            spd = np.insert(spd, 0, 0)
+        return spd
+
+    def clean_speed(self, start_i, end_i, max_step=10):
+        """Sets the recorded speed of records start_i..end_i-1 and returns
+        the time deltas and the new speeds in m/s.
+        """
+        recs = [ self[i] for i in range(start_i, end_i) ]
+        td = self.time_deltas(start_i, end_i)
+        spd = self.calculated_speeds(start_i, end_i, td)
+        rec_spd = np.array([ r.speed for r in recs ], dtype=float) * 60 * 60 / 1000
+        cadence = np.array([ r.cadence for r in recs ], dtype=float)
+        self.ratio = None
+        self.ratio_span = (start_i, end_i)
+
+        pause = (td > max_step) & (cadence == 0)
+        outlier = ~pause & ((spd > self.max_speed) | (rec_spd > self.max_speed))
+        speed = np.where(pause, 0, np.fmax(rec_spd, spd)) * 1000 / 3600
+        for (r, v, o) in zip(recs, speed.tolist(), outlier.tolist()):
+            if not o:
+                r.speed = v
+
+        pina = []
+        for j in np.flatnonzero(outlier).tolist():
+            i = start_i + j
+            (avg_cad, var) = self.avg_spd_by_cad(i, 10, 10)
+            mix = random.triangular(-var, var)
+            nc = round(self[i].cadence + self[i].cadence * mix)
+            # print("HUHA %d, %.2f, %.2f, %.2f - ~%.2f, *%.2f, %.2f, %.2f" % (i, avg_cad, self[i].cadence, self[i].cadence * avg_cad, var, mix, nc, nc * avg_cad))
+            self[i].cadence = nc
+            self.ratio.set_cadence(i, nc)
+            pina.append(nc)
+            self.set_recorded_speed(i, self[i].cadence * avg_cad)
+            speed[j] = self[i].speed
+        return (td, speed)
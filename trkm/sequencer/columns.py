@@ -0,0 +1,117 @@
+import math
+from datetime import datetime, timezone
+import numpy as np
+
+FIELDS = ('lat', 'lon', 'alt', 'distance', 'speed', 'hr', 'cadence', 'temperature')
+# Mean earth radius in meters
+EARTH_RADIUS = 6371008.8
+
+
+def epoch(time):
+    if time.tzinfo is None:
+        time = time.replace(tzinfo=timezone.utc)
+    return time.timestamp()
+
+
+class ColumnRecord:
+    __slots__ = ('name', 'time') + FIELDS
+
+    def __init__(self, name, time, *values):
+        self.name = name
+        self.time = time
+        for (key, v) in zip(FIELDS, values):
+            if v is not None and math.isnan(v):
+                v = None
+            setattr(self, key, v)
+
+
+class Columns:
+    """Track data held as one NumPy array per field, with NaN marking
+    missing values and time stored as epoch seconds.
+    """
+    def __init__(self, name, time, tzinfo=None, **fields):
+        self.name = name
+        self.time = np.asarray(time, dtype=float)
+        self.tzinfo = tzinfo
+        for key in FIELDS:
+            v = fields.get(key)
+            if v is None:
+                v = np.full(len(self.time), np.nan)
+            else:
+                # Keep float32 columns as they are, mapped files rely on it
+                v = np.asarray(v)
+                if v.dtype.kind != 'f':
+                    v = v.astype(float)
+            setattr(self, key, v)
+
+    def from_records(name, records):
+        time = []
+        values = dict((key, []) for key in FIELDS)
+        tzinfo = None
+        for r in records:
+            if r.time is None:
+                continue
+            if not time:
+                tzinfo = r.time.tzinfo
+            time.append(epoch(r.time))
+            for key in FIELDS:
+                v = getattr(r, key, None)
+                values[key].append(np.nan if v is None else v)
+        return Columns(name, time, tzinfo=tzinfo, **values)
+
+    def select(self, mask):
+        fields = dict((key, getattr(self, key)[mask]) for key in FIELDS)
+        return Columns(self.name, self.time[mask], tzinfo=self.tzinfo, **fields)
+
+    def increasing(self):
+        """Drops points without a time and, like the activityio reader,
+        those going back in time.
+        """
+        time = np.where(np.isnan(self.time), -np.inf, self.time)
+        return self.select(~np.isnan(self.time) & (time >= np.maximum.accumulate(time)))
+
+    def interpolated(self):
+        """Returns a copy with every gap filled by linear interpolation over
+        time, repeating the nearest known value past either end.
+        """
+        fields = {}
+        for key in FIELDS:
+            v = getattr(self, key)
+            valid = ~np.isnan(v)
+            if valid.any() and not valid.all():
+                v = np.interp(self.time, self.time[valid], v[valid])
+            fields[key] = v
+        return Columns(self.name, self.time, tzinfo=self.tzinfo, **fields)
+
+    def value_at(self, key, t):
+        """Interpolates field key at epoch time t, assuming gaps have been
+        filled already.
+        """
+        v = getattr(self, key)
+        if not len(v) or np.isnan(v[0]):
+            return None
+        return float(np.interp(t, self.time, v))
+
+    def __len__(self):
+        return len(self.time)
+
+    def utcoffset(self):
+        """The UTC offset in seconds, NaN for naive times."""
+        if self.tzinfo is None:
+            return math.nan
+        if len(self.time):
+            return self.datetime(self.time[0]).utcoffset().total_seconds()
+        return self.tzinfo.utcoffset(datetime.now()).total_seconds()
+
+    def datetime(self, t):
+        if self.tzinfo is None:
+            return datetime.fromtimestamp(t, timezone.utc).replace(tzinfo=None)
+        return datetime.fromtimestamp(t, self.tzinfo)
+
+    def all(self):
+        cols = [ getattr(self, key).tolist() for key in FIELDS ]
+        for (t, *values) in zip(self.time.tolist(), *cols):
+            yield ColumnRecord(self.name, self.datetime(t), *values)
+
+    def __iter__(self):
+        return self.all()
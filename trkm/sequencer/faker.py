@@ -1,35 +1,9 @@
 import configparser
 import sys
-from datetime import datetime, timedelta
+from datetime import datetime
 import statistics, random
-
-class RecordWrapper:
-    def __init__(self, name, time, idx, data):
-        self.name = name
-        self.time = time
-        self._idx = idx
-        self._data = data
-
-    @property
-    def hr(self):
-        return self._data['hr']
-
-    @property
-    def distance(self):
-        return self._data['total_distance']
-
-    @property
-    def speed(self):
-        return self._data['speed']
-
-    @property
-    def cadence(self):
-        return self._data['cadence']
-
-    @property
-    def temperature(self):
-        return None
-
+import numpy as np
+from .columns import Columns, FIELDS, EARTH_RADIUS, epoch
 
 class Fragment:
     def __init__(self, length, start, end, min=None, max=None, starting_at=None):
@@ -81,10 +55,29 @@ class Fragment:
         return (None, None, None)
 
     def __len__(self):
-        if self._parts:
-            return sum(map(len, self._parts))
+        # Dividing never changes the length, the parts always add up to it
+        return self._length
+
+    def materialize(self, out=None, offset=0):
+        """Returns all values in one array, the same self[i] would give
+        for each i, in a single walk over the leaves.
+        """
+        if out is None:
+            out = np.empty(self._length)
+        if self._parts is None:
+            if self._length:
+                self.init_cache()
+                v = self._start + self._step * np.arange(self._length)
+                if self._min is not None:
+                    v = np.maximum(v, self._min)
+                if self._max is not None:
+                    v = np.minimum(v, self._max)
+                out[offset:offset+self._length] = v
         else:
-            return self._length
+            for elt in self._parts:
+                elt.materialize(out, offset)
+                offset += len(elt)
+        return out
 
 
     def divide(self, at, displacement=0, absolute=None):
@@ -160,8 +153,11 @@ class Fragment:
 
 
 class Faker:
-    def __init__(self, name):
+    def __init__(self, name, rnd=None):
         self.name = name
+        # A random.Random of its own makes the ride reproducible, and safe
+        # to generate alongside others; the default is the global one
+        self.random = rnd or random
         self.config = configparser.ConfigParser(interpolation=None, strict=True,
                                                 empty_lines_in_values=True)
         self.config.read(self.name)
@@ -175,12 +171,12 @@ class Faker:
         sys.exit(1)
 
     def displacement(self, val, lo, hi):
-        return random.triangular(lo, hi, val) - val
+        return self.random.triangular(lo, hi, val) - val
 
     def displace_midpoint(self, route, start, end, bounds, displacement_reduction):
         if end - start < self.min_frag_len:
             return
-        at = int(random.triangular(start, end, (start + end) / 2))
+        at = int(self.random.triangular(start, end, (start + end) / 2))
         v = route[at]
         lo = v - bounds
         hi = v + bounds
@@ -260,7 +256,7 @@ class Faker:
                                displacement_bounds,
                                displacement_reduction)
 
-        pp = sorted(map(lambda _: int(random.weibullvariate(length, 1.5)), pauses))
+        pp = sorted(map(lambda _: int(self.random.weibullvariate(length, 1.5)), pauses))
         #print("BEFORE-APU: %r" % route)
         for (i, p) in enumerate(pp):
             self.add_pause(route, p, length=pauses[i], lead_in=2, lead_out=2)
@@ -268,10 +264,10 @@ class Faker:
 
 
 
-        r0 = list(map(lambda i: route[i], range(0, length)))
-        min_v = min(r0)
-        max_v = max(r0)
-        m = statistics.mean(r0)
+        r0 = route.materialize()
+        min_v = r0.min()
+        max_v = r0.max()
+        m = statistics.mean(r0.tolist())
 
         f = avg_speed / m
         # if min_v * f < speed_range[0] or max_v * f > speed_range[1]:
@@ -283,14 +279,16 @@ class Faker:
         #print("Cut, m0: %r, m2: %r" % (m, mr))
 
 
-        return [ min(max(s * f, speed_range[0]),
-                     speed_range[1]) if s
-                 else 0
-                 for s in r0 ]
+        return np.where(r0 != 0,
+                        np.minimum(np.maximum(r0 * f, speed_range[0]), speed_range[1]),
+                        0)
 
 
 
-    def all(self):
+    def columns(self):
+        """Generates the whole ride at once as Columns. Speed is in km/h
+        as the route has it.
+        """
         cfg = self.config['training']
         cadence_range = self.parse_range(cfg['cadence'])
         speed_range = self.parse_range(cfg['speed'], parser=float)
@@ -309,7 +307,7 @@ class Faker:
         # from km to meters
         total_distance = float(cfg['distance']) * 1000
 
-        total_time = (time_range[1] - time_range[0]).seconds
+        total_time = int((time_range[1] - time_range[0]).total_seconds())
         avg_speed = (total_distance / 1000) / (total_time / 3600)
 
         cadence_acc_factor = (
@@ -322,40 +320,110 @@ class Faker:
 
         self.min_frag_len = 5 # seconds
 
-        route = self.route(total_time, avg_speed, speed_range, pauses)
+        speed = np.asarray(self.route(total_time, avg_speed, speed_range, pauses),
+                           dtype=float)
+        cadence = cadence_range[0] + (speed - speed_range[0]) * cadence_acc_factor
 
-        distance_so_far = 0
+        # Heart rate follows the mean cadence over hr_effect_lasting
+        # seconds, ending hr_effect_delay seconds ago, zero before the start
         hr_effect = hr_effect_delay + hr_effect_lasting
-        cadence_log = [ 0 ] * hr_effect
-
-        prev_t = 0
-        for t in range(0, total_time):
-            speed = route[t]
-            dist = speed * 1000 / 3600 * (t - prev_t)
-            cadence = (cadence_range[0]
-                       + (speed - speed_range[0]) * cadence_acc_factor)
-            cadence_log = cadence_log[1:] + [ cadence ]
-            cm = statistics.mean(cadence_log[0:hr_effect_lasting])
-            if cm >= cadence_range[0]:
-                hr = hr_range[0] + (cm - cadence_range[0]) * hr_factor
-            else:
-                hr = base_hr + hr_factor0 * cm
-            distance_so_far += dist
-            hr = round(hr)
-            cadence = round(cadence)
-            # print("At %d, speed: %.2f, dist: %.2f, total dist: %.2f, cadence: %.2f, cm: %.2f, hr: %.2f"
-            #       % (t, speed, dist, distance_so_far, cadence, cm, hr))
-
-            data = {
-                'hr': hr,
-                'total_distance': distance_so_far,
-                'speed': speed,
-                'cadence': cadence
-            }
-            prev_t = t
-            yield RecordWrapper(self.name,
-                                time_range[0] + timedelta(seconds=t), t, data)
+        log = np.concatenate([ np.zeros(hr_effect), cadence ])
+        cm = np.convolve(log, np.ones(hr_effect_lasting), 'valid')[1:total_time+1]
+        cm /= hr_effect_lasting
+        hr = np.where(cm >= cadence_range[0],
+                      hr_range[0] + (cm - cadence_range[0]) * hr_factor,
+                      base_hr + hr_factor0 * cm)
+
+        # One second per point, nothing is covered before the first one
+        step = speed * 1000 / 3600
+        step[:1] = 0
+        if 'position' in cfg:
+            (lat, lon) = self.positions(step, self.parse_range(cfg['position'],
+                                                               parser=float))
+        else:
+            (lat, lon) = (None, None)
+        return Columns(self.name, epoch(time_range[0]) + np.arange(total_time),
+                       tzinfo=time_range[0].tzinfo, lat=lat, lon=lon,
+                       hr=np.round(hr), distance=np.cumsum(step), speed=speed,
+                       cadence=np.round(cadence))
+
+    def positions(self, step, start):
+        """Latitude and longitude along a path wandering off from start,
+        covering step meters each second.
+        """
+        rnd = np.random.RandomState(self.random.getrandbits(32))
+        heading = (rnd.uniform(0, 2 * np.pi)
+                   + np.cumsum(rnd.normal(0, np.radians(2), len(step))))
+        lat = start[0] + np.degrees(np.cumsum(step * np.cos(heading)) / EARTH_RADIUS)
+        east = np.cumsum(step * np.sin(heading) / np.cos(np.radians(lat)))
+        return (lat, start[1] + np.degrees(east / EARTH_RADIUS))
+
+    def device_names(self):
+        """Names of the [device NAME] sections, in file order."""
+        return [ s.split(None, 1)[1] for s in self.config.sections()
+                 if s.split(None, 1)[0] == 'device' and len(s.split(None, 1)) == 2 ]
+
+    def device(self, ride, name, rnd):
+        """What the device would have recorded of the ride: sampled every
+        interval seconds, time stamped by a clock clock_offset seconds off,
+        with gps_noise meters of noise on the position, the missing
+        channels left out, distance_error percent off on distance and
+        dropouts windows of dropout_length seconds without any points.
+        """
+        cfg = self.config['device ' + name]
+        interval = float(cfg.get('interval', '1'))
+        clock_offset = float(cfg.get('clock_offset', '0'))
+        gps_noise = float(cfg.get('gps_noise', '0'))
+        missing = [ k.strip() for k in cfg.get('missing', '').split(',') if k.strip() ]
+        distance_error = float(cfg.get('distance_error', '0')) / 100
+        dropouts = int(cfg.get('dropouts', '0'))
+        dropout_length = self.parse_range(cfg.get('dropout_length', '10, 120'),
+                                          parser=float)
+        for key in missing:
+            if key not in FIELDS:
+                self.error("Device %s: unknown channel '%s'" % (name, key))
+        if interval <= 0:
+            self.error("Device %s: interval must be positive" % name)
+
+        time = np.arange(ride.time[0], ride.time[-1] + 1, interval)
+        keep = np.ones(len(time), dtype=bool)
+        for _ in range(dropouts):
+            start = rnd.uniform(time[0], time[-1])
+            keep &= ~((time >= start) & (time < start + rnd.uniform(*dropout_length)))
+        time = time[keep]
+
+        fields = {}
+        for key in FIELDS:
+            v = getattr(ride, key)
+            if key not in missing and not np.isnan(v).all():
+                fields[key] = np.interp(time, ride.time, v)
+        if gps_noise and 'lat' in fields and 'lon' in fields:
+            noise = np.degrees(rnd.normal(0, gps_noise, (2, len(time))) / EARTH_RADIUS)
+            fields['lat'] += noise[0]
+            fields['lon'] += noise[1] / np.cos(np.radians(fields['lat']))
+        if 'distance' in fields:
+            fields['distance'] *= 1 + distance_error
+        for key in ('hr', 'cadence'):
+            if key in fields:
+                fields[key] = np.round(fields[key])
+        return Columns("%s:%s" % (self.name, name), time + clock_offset,
+                       tzinfo=ride.tzinfo, **fields)
+
+    def devices(self):
+        """One track for every [device NAME] section, all recording the
+        same ride, or just the ride if there are none.
+        """
+        ride = self.columns()
+        names = self.device_names()
+        if not names:
+            return [ ride ]
+        # Each device gets a generator of its own, seeded in turn, so the
+        # tracks stay the same however many devices follow
+        return [ self.device(ride, name, np.random.RandomState(self.random.getrandbits(32)))
+                 for name in names ]
 
+    def all(self):
+        yield from self.columns()
 
     def __iter__(self):
         self._g = self.all()
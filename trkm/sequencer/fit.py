@@ -0,0 +1,209 @@
+import mmap
+import struct
+from datetime import timezone
+import numpy as np
+from .columns import Columns
+
+# Seconds between the Unix epoch and the FIT epoch, 1989-12-31 00:00 UTC
+FIT_EPOCH = 631065600
+
+RECORD = 20
+TIMESTAMP = 253
+
+# Base type number -> (numpy type, invalid value)
+BASE_TYPES = {
+    0x00: ('u1', 0xFF),         # enum
+    0x01: ('i1', 0x7F),
+    0x02: ('u1', 0xFF),
+    0x03: ('i2', 0x7FFF),
+    0x04: ('u2', 0xFFFF),
+    0x05: ('i4', 0x7FFFFFFF),
+    0x06: ('u4', 0xFFFFFFFF),
+    0x08: ('f4', None),
+    0x09: ('f8', None),
+    0x0A: ('u1', 0),            # uint8z
+    0x0B: ('u2', 0),
+    0x0C: ('u4', 0),
+    0x0D: ('u1', 0xFF),         # byte
+    0x0E: ('i8', 0x7FFFFFFFFFFFFFFF),
+    0x0F: ('u8', 0xFFFFFFFFFFFFFFFF),
+    0x10: ('u8', 0),
+}
+
+# Record message fields: name -> [(field number, scale, offset)], the
+# first one present wins
+RECORD_FIELDS = {
+    'lat': [ (0, 2**31 / 180.0, 0) ],
+    'lon': [ (1, 2**31 / 180.0, 0) ],
+    'alt': [ (78, 5, 500), (2, 5, 500) ],
+    'distance': [ (5, 100, 0) ],
+    'speed': [ (73, 1000, 0), (6, 1000, 0) ],
+    'hr': [ (3, 1, 0) ],
+    'cadence': [ (4, 1, 0) ],
+    'temperature': [ (13, 1, 0) ],
+}
+
+
+class Definition:
+    def __init__(self, endian, message, fields, size):
+        self.endian = endian
+        self.message = message
+        # field number -> (offset in the message, numpy type, invalid value)
+        self.fields = fields
+        self.size = size
+        self.offsets = []
+        self.times = []
+
+    def dtype(self):
+        names = []
+        formats = []
+        offsets = []
+        for (num, (pos, typ, _)) in self.fields.items():
+            names.append('f%d' % num)
+            formats.append(self.endian + typ)
+            offsets.append(pos)
+        return np.dtype({ 'names': names, 'formats': formats,
+                          'offsets': offsets, 'itemsize': self.size })
+
+
+class FitFile:
+    """Decodes the record messages of a FIT file straight into Columns.
+
+    One pass over the memory mapped file follows the definition messages
+    to find where each record is, and tracks timestamps so that compressed
+    timestamp headers can be resolved. The fields are then gathered for
+    all records sharing a definition at once with a structured dtype.
+    Raises ValueError for anything that does not look like a FIT file.
+    """
+    def __init__(self, file_name):
+        self.name = file_name
+
+    def scan(self, buf):
+        definitions = {}
+        pos = 0
+        while pos + 12 <= len(buf):
+            (header_size, _, _, data_size, magic) = struct.unpack_from('<BBHI4s', buf, pos)
+            if magic != b'.FIT' or header_size < 12:
+                raise ValueError("%s is not a FIT file" % self.name)
+            pos += header_size
+            end = pos + data_size
+            if end > len(buf):
+                raise ValueError("%s is truncated" % self.name)
+            last_time = None
+            local = {}
+            while pos < end:
+                header = buf[pos]
+                pos += 1
+                if header & 0x80:
+                    # Compressed timestamp, five bits of offset
+                    d = local.get((header >> 5) & 0x03)
+                    if d is None:
+                        raise ValueError("%s: undefined message at %d" % (self.name, pos))
+                    offset = header & 0x1F
+                    if last_time is not None:
+                        t = (last_time & ~0x1F) + offset
+                        if offset < (last_time & 0x1F):
+                            t += 0x20
+                        last_time = t
+                    self.fits(pos - 1, pos + d.size, end)
+                    if d.message == RECORD:
+                        d.offsets.append(pos)
+                        d.times.append(last_time)
+                    pos += d.size
+                elif header & 0x40:
+                    start = pos - 1
+                    self.fits(start, pos + 5, end)
+                    (arch, message, count) = struct.unpack_from('<xBHB', buf, pos)
+                    endian = '>' if arch else '<'
+                    if arch:
+                        message = (message >> 8) | ((message & 0xFF) << 8)
+                    pos += 5
+                    self.fits(start, pos + 3*count, end)
+                    fields = {}
+                    size = 0
+                    for (num, fsize, base) in struct.iter_unpack('BBB', buf[pos:pos + 3*count]):
+                        typ = BASE_TYPES.get(base & 0x1F)
+                        if typ and np.dtype(typ[0]).itemsize == fsize:
+                            fields[num] = (size, typ[0], typ[1])
+                        size += fsize
+                    pos += 3*count
+                    if header & 0x20:
+                        self.fits(start, pos + 1, end)
+                        dev_count = buf[pos]
+                        pos += 1
+                        self.fits(start, pos + 3*dev_count, end)
+                        size += sum(buf[pos + 3*i + 1] for i in range(dev_count))
+                        pos += 3*dev_count
+                    d = Definition(endian, message, fields, size)
+                    local[header & 0x0F] = d
+                    definitions[id(d)] = d
+                else:
+                    d = local.get(header & 0x0F)
+                    if d is None:
+                        raise ValueError("%s: undefined message at %d" % (self.name, pos))
+                    self.fits(pos - 1, pos + d.size, end)
+                    if TIMESTAMP in d.fields:
+                        (tpos, _, invalid) = d.fields[TIMESTAMP]
+                        t = struct.unpack_from(d.endian + 'I', buf, pos + tpos)[0]
+                        if t != invalid:
+                            last_time = t
+                    if d.message == RECORD:
+                        d.offsets.append(pos)
+                        d.times.append(last_time)
+                    pos += d.size
+            # Skip the file CRC, more FIT files may be chained after it
+            pos = end + 2
+        return [ d for d in definitions.values() if d.message == RECORD and d.offsets ]
+
+    def fits(self, start, stop, end):
+        """Raises ValueError unless the message at start, ending at stop,
+        is inside the data ending at end.
+        """
+        if stop > end:
+            raise ValueError("%s: message at %d runs past the end of the data"
+                             % (self.name, start))
+
+    def gather(self, data, d):
+        """Returns a dict of float arrays for the records using definition d."""
+        offsets = np.array(d.offsets, dtype=np.int64)
+        rows = data[offsets[:, None] + np.arange(d.size)]
+        msgs = np.ascontiguousarray(rows).view(d.dtype()).reshape(len(offsets))
+        times = np.array([ np.nan if t is None else t for t in d.times ], dtype=float)
+        fields = { 'time': times + FIT_EPOCH }
+        for (key, candidates) in RECORD_FIELDS.items():
+            v = np.full(len(offsets), np.nan)
+            for (num, scale, offset) in candidates:
+                if num not in d.fields:
+                    continue
+                (_, _, invalid) = d.fields[num]
+                raw = msgs['f%d' % num]
+                values = raw.astype(float) / scale - offset
+                if invalid is not None:
+                    values[raw == invalid] = np.nan
+                # Earlier candidates win, later ones only fill their gaps
+                v = np.where(np.isnan(v), values, v)
+            fields[key] = v
+        return fields
+
+    def columns(self):
+        with open(self.name, 'rb') as f:
+            if not f.seek(0, 2):
+                raise ValueError("%s is empty" % self.name)
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                definitions = self.scan(m)
+                data = np.frombuffer(m, dtype=np.uint8)
+                try:
+                    parts = [ self.gather(data, d) for d in definitions ]
+                finally:
+                    # The mapping cannot be closed while data points into it
+                    del data
+        if not parts:
+            raise ValueError("%s has no records" % self.name)
+        fields = dict((key, np.concatenate([ p[key] for p in parts ]))
+                      for key in parts[0])
+        order = np.argsort(np.concatenate([ d.offsets for d in definitions ]),
+                           kind='mergesort')
+        for key in fields:
+            fields[key] = fields[key][order]
+        time = fields.pop('time')
+        return Columns(self.name, time, tzinfo=timezone.utc, **fields).increasing()
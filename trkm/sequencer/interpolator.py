@@ -1,130 +1,104 @@
-import gpxdata
 import math
+import bisect
+from array import array
 from .zipper import ZipperWrapper
+from .columns import Columns, FIELDS, epoch
 
 class InterpolatorPointWrapper:
-    def __init__(self, point, lst, name=None, time=None, real=True):
+    __slots__ = ('point', 'lst', 'name', 'time', 'real', 'idx', 'seq')
+
+    def __init__(self, point, lst, name=None, time=None, real=True, seq=None):
         self.point = point
         self.lst = lst
         self.name = name or point.name
         self.time = time or point.time
-        self.collected = {}
         self.real = real
+        self.idx = None
+        # Position among the real points, which is where the shared
+        # channel caches of the Interpolator keep our values
+        self.seq = seq
 
     def __getattr__(self, key):
+        if self.lst.columns is not None and key in FIELDS:
+            if self.real:
+                return getattr(self.point, key)
+            self.lst.interpolated += 1
+            return self.lst.columns.value_at(key, epoch(self.time))
+        if key in FIELDS:
+            return self.lst.value(key, self)
         if self.real:
-            v = self.getattr_local(key)
-            if v is not None:
-                v0 = (self, v)
-            else:
-                v0 = None
-            v1 = None
-        else:
-            v0 = self.getattr(key, direction=-1)
-        if v0 and v0[1] == None:
-            v0 = None
-        if v0 and v0[0] == self:
-            return v0[1]
-        else:
-            v1 = self.getattr(key, direction=1)
-            if v1 and v1[1] == None:
-                v1 = None
-        if v0 and v1:
-            tdelta_t = (v1[0].time - v0[0].time).seconds
-            tdelta_c = (self.time - v0[0].time).seconds
-            if False and key in ['lat', 'lon']:
-                ratio = tdelta_c / tdelta_t
-                (lat, lon) = gpxdata.Util.interpolate(v0[0].lat, v0[0].lon,
-                                                      v1[0].lat, v1[0].lon,
-                                                      ratio)
-                if key == 'lat':
-                    return lat
-                else:
-                    return lon
-            else:
-                v = v0[1] + (v1[1] - v0[1]) / tdelta_t * tdelta_c
+            v = getattr(self.point, key)
+            if v is not None and not math.isnan(v):
                 return v
-        elif v0:
-            return v0[1]
-        elif v1:
-            return v1[1]
-        else:
-            return None
-
-    def getattr(self, key, direction=0, force=False):
-        if (key, direction) in self.collected:
-            return self.collected[(key, direction)]
-        if force:
-            v = None
-        else:
-            v = self.getattr_local(key)
-        if v != None:
-            self.collected[(key, direction)] = (self, v)
-            return (self, v)
-        elif direction != 0:
-            pt = self.lst.neighbor(self, direction)
-            while pt != None:
-                v = pt.getattr(key)
-                if v != None:
-                    self.collected[(key, direction)] = v
-                    return v
-                else:
-                    pt = self.lst.neighbor(pt, direction)
-        self.collected[(key, direction)] = (self, None)
         return None
 
-    def getattr_local(self, key):
-        if key in self.__dict__:
-            v = self.__dict__[key]
-        elif key in type(self).__dict__:
-            v = type(self).__dict__[key]
-        elif self.point != None:
-            v = getattr(self.point, key)
-            if v != None and not math.isnan(v):
-                setattr(self, key, v)
-            else:
-                v = None
-        else:
-            v = None
-        return v
-
 
 class Deduplicator(ZipperWrapper):
     def __init__(self, name, points, lst, time=None):
         super().__init__(name, points)
         self.lst = lst
         self.time = time or points[0].time
-        self.collected = {}
+        self.idx = None
 
-    def getattr(self, key, direction=0, force=False):
-        if (key, direction) in self.collected:
-            return self.collected[(key, direction)]
-        if force:
-            v = None
+
+class Channel:
+    """One field of all real points of an Interpolator, in load order.
+
+    Besides the values (NaN when missing) it keeps, for every point, the
+    index of the nearest known value at or before it, and lazily the one
+    at or after it, so gaps are resolved without walking the points.
+    """
+    UNRESOLVED = -2
+
+    def __init__(self):
+        self.values = array('d')
+        self.before = array('i')
+        self.after = array('i')
+
+    def set(self, i, v):
+        if v is None or math.isnan(v):
+            v = math.nan
+        if i == len(self.values):
+            self.values.append(v)
+            self.before.append(-1)
+            self.after.append(Channel.UNRESOLVED)
         else:
-            v = getattr(self, key)
-        if v != None:
-            self.collected[(key, direction)] = (self, v)
-            return (self, v)
-        elif direction != 0:
-            pt = self.lst.neighbor(self, direction)
-            while pt != None:
-                v = pt.getattr(key)
-                if v != None:
-                    self.collected[(key, direction)] = v
-                    return v
-                else:
-                    pt = self.lst.neighbor(pt, direction)
-        self.collected[(key, direction)] = (self, None)
-        return None
+            self.values[i] = v
+            j = i
+            while j >= 0 and self.after[j] == i:
+                self.after[j] = Channel.UNRESOLVED
+                j -= 1
+        if not math.isnan(v):
+            self.before[i] = i
+            self.after[i] = i
+        elif i > 0:
+            self.before[i] = self.before[i-1]
+        else:
+            self.before[i] = -1
 
 
 class Interpolator:
     def __init__(self, sequencer):
-        self.by_time_idx = dict()
-        self.last_used_time = None
-        self.last_used_time_idx = None
         self.points = []
+        # Epoch seconds of self.points, kept sorted for bisect
+        self.times = array('d')
+        # Points from this index on may carry a stale idx
+        self.stale = 0
+        # Per-field caches over the real points and their times
+        self.channels = dict((key, Channel()) for key in FIELDS)
+        self.real_times = array('d')
+        # Counters for --stats: points read, synthetic points inserted
+        # and values interpolated for points lacking them
+        self.loaded = 0
+        self.inserted = 0
+        self.interpolated = 0
+        if isinstance(sequencer, Columns):
+            # Fill all gaps at once, synthetic points then just sample
+            # the filled columns
+            sequencer = sequencer.interpolated()
+            self.columns = sequencer
+        else:
+            self.columns = None
         self.sequencer = iter(sequencer)
         #self.name = sequencer.name + ':ipt'
 
@@ -142,41 +116,34 @@ class Interpolator:
                 pass
             return (self.points[k], True)
         else: # timestamp
-            if k in self.by_time_idx:
-                return (self.points[self.by_time_idx[k]], True)
-            if self.last_used_time and self.last_used_time <= k:
-                i = self.last_used_time_idx
+            t = epoch(k)
+            try:
+                while not self.times or self.times[-1] < t:
+                    self.load_next()
+            except StopIteration:
+                pass
+            i = bisect.bisect_left(self.times, t)
+            j = bisect.bisect_right(self.times, t, i)
+            if j - i == 1:
+                return (self.points[i], True)
+            elif j > i:
+                # repeated timestamps
+                pt = Deduplicator("ddp", self.points[i:j], self, time=k)
+                self.points[i:j] = [pt]
+                self.times[i:j] = array('d', [t])
+                pt.idx = i
+                self.stale = min(self.stale, i)
+                return (pt, True)
+            elif return_empty:
+                pt = InterpolatorPointWrapper(None, self, name=self.name, time=k, real=False)
+                self.inserted += 1
+                self.points.insert(i, pt)
+                self.times.insert(i, t)
+                pt.idx = i
+                self.stale = min(self.stale, i)
+                return (pt, False)
             else:
-                i = 0
-            first_match = None
-            # print("Getting %s" % (k,))
-            while True:
-                if i >= len(self.points) or self.points[i].time > k:
-                    if first_match and first_match == i - 1:
-                        # print("  true:A %s" % (k, ))
-                        return (self.points[first_match], True)
-                    elif first_match is not None:
-                        # repeated timestamps
-                        pt = Deduplicator("ddp", self.points[first_match:i], self, time=k)
-                        self.points[first_match:i] = [pt]
-                        self.last_used_time = k
-                        self.last_used_time_idx = i
-                        # print("  true:B %s" % (k, ))
-                        return (pt, True)
-                    else:
-                        if return_empty:
-                            pt = InterpolatorPointWrapper(None, self, name=self.name, time=k, real=False)
-                            self.points[i:i] = [pt]
-                        else:
-                            pt = None
-                        # #print("Inserting %r at %r in %s" % (pt.time, i, self.name))
-                        # print("  false:C %s, %r" % (k, pt.distance if pt else None))
-                        return (pt, False)
-                elif self.points[i].time == k:
-                    self.by_time_idx[self.points[i].time] = i
-                    if first_match == None:
-                        first_match = i
-                i += 1
+                return (None, False)
 
     def load_next(self):
         if self.sequencer == None:
@@ -188,21 +155,100 @@ class Interpolator:
         except StopIteration:
             self.sequencer = None
             raise
+        self.loaded += 1
         if self.points and self.points[-1].time == pt.time:
-            self.points[-1] = InterpolatorPointWrapper(pt, self)
+            w = InterpolatorPointWrapper(pt, self, seq=self.points[-1].seq)
+            self.points[-1] = w
         else:
-            self.points.append(InterpolatorPointWrapper(pt, self))
+            w = InterpolatorPointWrapper(pt, self, seq=len(self.real_times))
+            self.points.append(w)
+            self.times.append(epoch(pt.time))
+            self.real_times.append(self.times[-1])
+        w.idx = len(self.points) - 1
+        if self.columns is None:
+            for (key, ch) in self.channels.items():
+                ch.set(w.seq, getattr(pt, key, None))
 
     def first(self):
         return self[0]
 
+    def index(self, point):
+        if point.idx is None:
+            return None
+        if point.idx >= self.stale:
+            for i in range(self.stale, len(self.points)):
+                self.points[i].idx = i
+            self.stale = len(self.points)
+        if point.idx < len(self.points) and self.points[point.idx] is point:
+            return point.idx
+        return None
+
     def neighbor(self, point, step=1):
-        for i in range(0, len(self.points)):
-            if self.points[i] == point:
-                if i + step < 0:
-                    return None
+        i = self.index(point)
+        if i is None or i + step < 0:
+            return None
+        try:
+            return self[i+step]
+        except IndexError:
+            return None
+
+    def after(self, ch, i):
+        """Index of the first known value at or after real point i,
+        loading more points when needed, or -1 if there is none.
+        """
+        j = i
+        while True:
+            if j >= len(ch.values):
                 try:
-                    return self[i+step]
-                except IndexError:
-                    return None
-        return None
+                    self.load_next()
+                except StopIteration:
+                    found = -1
+                    break
+                continue
+            if ch.after[j] != Channel.UNRESOLVED:
+                found = ch.after[j]
+                break
+            j += 1
+        for k in range(i, min(j, len(ch.after))):
+            ch.after[k] = found
+        return found
+
+    def value(self, key, point):
+        ch = self.channels[key]
+        if point.real:
+            i = point.seq
+            v = ch.values[i]
+            if not math.isnan(v):
+                return v
+            t = self.real_times[i]
+            v0 = ch.before[i]
+        else:
+            t = epoch(point.time)
+            i = bisect.bisect_left(self.real_times, t)
+            v0 = ch.before[i-1] if i > 0 else -1
+        v1 = self.after(ch, i)
+        if v0 >= 0 and v1 >= 0:
+            tdelta_t = self.real_times[v1] - self.real_times[v0]
+            tdelta_c = t - self.real_times[v0]
+            if False and key in ['lat', 'lon']:
+                # Geodesic interpolation, gpxdata is only needed here
+                import gpxdata
+                ratio = tdelta_c / tdelta_t
+                lat = self.channels['lat'].values
+                lon = self.channels['lon'].values
+                (lat, lon) = gpxdata.Util.interpolate(lat[v0], lon[v0],
+                                                      lat[v1], lon[v1],
+                                                      ratio)
+                if key == 'lat':
+                    return lat
+                else:
+                    return lon
+            else:
+                self.interpolated += 1
+                return ch.values[v0] + (ch.values[v1] - ch.values[v0]) / tdelta_t * tdelta_c
+        elif v0 >= 0:
+            return ch.values[v0]
+        elif v1 >= 0:
+            return ch.values[v1]
+        else:
+            return None
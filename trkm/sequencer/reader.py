@@ -0,0 +1,48 @@
+import os
+from .activityio import AIO
+from .fit import FitFile
+from .trackfile import TrackFile
+from .xmltrack import GPXFile, TCXFile
+
+READERS = {
+    '.fit': FitFile,
+    '.gpx': GPXFile,
+    '.tcx': TCXFile,
+}
+
+
+def parse(file_name):
+    """Parses with the native reader for the extension, leaving whatever
+    it cannot handle to activityio. If that fails too, the native error
+    is raised, it says what is wrong with the file.
+    """
+    reader = READERS.get(os.path.splitext(file_name)[1].lower())
+    if reader is None:
+        return AIO.open(file_name).columns()
+    try:
+        return reader(file_name).columns()
+    except ValueError as e:
+        error = e
+    try:
+        return AIO.open(file_name).columns()
+    except Exception as e:
+        raise error from e
+
+
+def read(file_name, cache=None):
+    """Parses a track file into Columns, or loads them from the cache.
+
+    Only plain arrays come back, so this is also what worker processes run
+    when inputs are parsed in parallel. Track files (.trk) are mapped
+    rather than read, they never go through the cache.
+    """
+    if os.path.splitext(file_name)[1].lower() == '.trk':
+        return TrackFile(file_name).columns()
+    if cache is None:
+        return parse(file_name)
+    key = cache.key(file_name)
+    columns = cache.load(key, file_name)
+    if columns is None:
+        columns = parse(file_name)
+        cache.store(key, columns)
+    return columns
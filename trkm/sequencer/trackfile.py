@@ -0,0 +1,73 @@
+import math
+import struct
+from datetime import timedelta, timezone
+import numpy as np
+from .columns import Columns, FIELDS
+
+
+class TrackFile:
+    """A track in a compact binary format read through numpy.memmap.
+
+    After a header holding the point count, UTC offset and name, every
+    field is stored as one fixed-width little-endian column. Missing values
+    are stored as NaN, so the mapped columns can be used directly.
+    """
+    MAGIC = b'TRKMCOL1'
+    HEADER = struct.Struct('<8sIIQdI')
+    VERSION = 2
+    COLUMNS = [ ('time', '<f8'), ('lat', '<f8'), ('lon', '<f8'), ('alt', '<f4'),
+                ('distance', '<f8'), ('speed', '<f4'), ('hr', '<f4'),
+                ('cadence', '<f4'), ('temperature', '<f4') ]
+
+    def __init__(self, file_name):
+        with open(file_name, 'rb') as f:
+            header = f.read(TrackFile.HEADER.size)
+            (magic, version, _, count, offset, name_len) = TrackFile.HEADER.unpack(header)
+            if magic != TrackFile.MAGIC or version != TrackFile.VERSION:
+                raise ValueError("%s is not a track file" % file_name)
+            self.name = f.read(name_len).decode('utf-8')
+        if math.isnan(offset):
+            self.tzinfo = None
+        else:
+            self.tzinfo = timezone(timedelta(seconds=offset))
+        self.count = count
+        self.arrays = {}
+        for (key, dtype, pos) in TrackFile.layout(count, name_len):
+            if count:
+                self.arrays[key] = np.memmap(file_name, dtype=dtype, mode='r',
+                                             offset=pos, shape=(count,))
+            else:
+                self.arrays[key] = np.zeros(0, dtype=dtype)
+
+    def layout(count, name_len):
+        pos = TrackFile.align(TrackFile.HEADER.size + name_len)
+        for (key, dtype) in TrackFile.COLUMNS:
+            yield (key, dtype, pos)
+            pos = TrackFile.align(pos + count * np.dtype(dtype).itemsize)
+
+    def align(pos):
+        return (pos + 7) // 8 * 8
+
+    def columns(self):
+        fields = dict((key, self.arrays[key]) for key in FIELDS)
+        return Columns(self.name, self.arrays['time'], tzinfo=self.tzinfo, **fields)
+
+    def write(file_name, columns):
+        name = (columns.name or "").encode('utf-8')
+        count = len(columns)
+        offset = columns.utcoffset()
+        layout = list(TrackFile.layout(count, len(name)))
+        (_, dtype, pos) = layout[-1]
+        size = pos + count * np.dtype(dtype).itemsize
+        with open(file_name, 'wb') as f:
+            f.write(TrackFile.HEADER.pack(TrackFile.MAGIC, TrackFile.VERSION, 0,
+                                          count, offset, len(name)))
+            f.write(name)
+            f.truncate(size)
+        if not count:
+            return
+        for (key, dtype, pos) in layout:
+            m = np.memmap(file_name, dtype=dtype, mode='r+', offset=pos, shape=(count,))
+            m[:] = getattr(columns, key)
+            m.flush()
+            del m
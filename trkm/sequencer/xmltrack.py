@@ -0,0 +1,164 @@
+import math
+import xml.etree.ElementTree as ET
+from array import array
+from datetime import datetime
+import numpy as np
+from .columns import Columns, FIELDS, EARTH_RADIUS, epoch
+
+
+def parse_time(s):
+    s = s.strip()
+    if s.endswith('Z'):
+        s = s[:-1] + '+00:00'
+    return datetime.fromisoformat(s)
+
+
+def haversine(lat, lon):
+    """Cumulative distance in meters along the points, those without a
+    position add nothing.
+    """
+    valid = ~(np.isnan(lat) | np.isnan(lon))
+    dist = np.zeros(len(lat))
+    if valid.sum() < 2:
+        return dist
+    (phi, lam) = (np.radians(lat[valid]), np.radians(lon[valid]))
+    a = (np.sin(np.diff(phi) / 2) ** 2
+         + np.cos(phi[:-1]) * np.cos(phi[1:]) * np.sin(np.diff(lam) / 2) ** 2)
+    step = 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1)))
+    dist[np.flatnonzero(valid)[1:]] = step
+    return np.cumsum(dist)
+
+
+class XMLTrack:
+    """Reads the points of an XML track file with iterparse, removing each
+    point element once its values are taken so memory use stays flat no
+    matter how long the track is.
+
+    Subclasses name the point element and map the local names of the
+    elements inside it to fields. Namespaces are ignored, so any version
+    of the Garmin extensions will do.
+    """
+    POINT = None
+    TAGS = {}
+
+    def __init__(self, file_name):
+        self.name = file_name
+        self.tzinfo = None
+
+    def local(tag):
+        return tag.rsplit('}', 1)[-1]
+
+    def point(self, elem):
+        """Returns the values taken from the point element itself."""
+        return {}
+
+    def points(self):
+        """Yields (time, values) for every point, in file order."""
+        stack = []
+        current = None
+        names = {}
+        for (event, elem) in ET.iterparse(self.name, events=('start', 'end')):
+            tag = names.get(elem.tag)
+            if tag is None:
+                tag = names[elem.tag] = XMLTrack.local(elem.tag)
+            if event == 'start':
+                stack.append(elem)
+                if current is None and tag == self.POINT:
+                    current = self.point(elem)
+                continue
+            stack.pop()
+            if current is None:
+                continue
+            if tag == self.POINT:
+                time = current.pop('time', None)
+                if time is not None:
+                    yield (time, current)
+                current = None
+                # Drop the point from its parent too, clear() alone leaves
+                # an empty element behind for each one
+                elem.clear()
+                if stack:
+                    stack[-1].remove(elem)
+            elif tag in self.TAGS and elem.text:
+                key = self.TAGS[tag]
+                if key == 'time':
+                    try:
+                        current[key] = parse_time(elem.text)
+                    except ValueError:
+                        raise ValueError("%s: bad time '%s'"
+                                         % (self.name, elem.text.strip()))
+                else:
+                    try:
+                        current[key] = float(elem.text)
+                    except ValueError:
+                        pass
+
+    def fill(self):
+        time = array('d')
+        values = dict((key, array('d')) for key in FIELDS)
+        for (t, point) in self.points():
+            if not time:
+                self.tzinfo = t.tzinfo
+            time.append(epoch(t))
+            for key in FIELDS:
+                values[key].append(point.get(key, math.nan))
+        return (time, values)
+
+    def columns(self):
+        try:
+            (time, values) = self.fill()
+        except ET.ParseError as e:
+            raise ValueError("%s: %s" % (self.name, e))
+        if not time:
+            raise ValueError("%s has no track points" % self.name)
+        fields = dict((key, np.frombuffer(v, dtype=float)) for (key, v) in values.items())
+        return Columns(self.name, np.frombuffer(time, dtype=float),
+                       tzinfo=self.tzinfo, **fields).increasing()
+
+
+class GPXFile(XMLTrack):
+    """GPX track points, with heart rate, cadence, temperature and speed
+    from the Garmin TrackPointExtension. GPX carries no distance, so it is
+    computed along the track.
+    """
+    POINT = 'trkpt'
+    TAGS = {
+        'time': 'time',
+        'ele': 'alt',
+        'hr': 'hr',
+        'cad': 'cadence',
+        'atemp': 'temperature',
+        'speed': 'speed',
+    }
+
+    def point(self, elem):
+        values = {}
+        for key in ('lat', 'lon'):
+            try:
+                values[key] = float(elem.get(key))
+            except (TypeError, ValueError):
+                pass
+        return values
+
+    def columns(self):
+        columns = XMLTrack.columns(self)
+        if np.isnan(columns.distance).all():
+            columns.distance = haversine(columns.lat, columns.lon)
+        return columns
+
+
+class TCXFile(XMLTrack):
+    """TCX track points, with speed from the ActivityExtension."""
+    POINT = 'Trackpoint'
+    TAGS = {
+        'Time': 'time',
+        'LatitudeDegrees': 'lat',
+        'LongitudeDegrees': 'lon',
+        'AltitudeMeters': 'alt',
+        'DistanceMeters': 'distance',
+        # The only Value in a Trackpoint is inside HeartRateBpm
+        'Value': 'hr',
+        'Cadence': 'cadence',
+        'RunCadence': 'cadence',
+        'Speed': 'speed',
+    }
@@ -1,6 +1,8 @@
 import statistics
 import numbers
 import math
+import numpy as np
+from .columns import Columns, FIELDS
 
 class ZipperWrapper:
     def __init__(self, name, points, bases=[]):
@@ -38,9 +40,9 @@ class ZipperWrapper:
             #     print("DIST: %r" % l)
             if l:
                 v = statistics.mean(l)
-                setattr(self, key, v)
             else:
                 v = None
+            setattr(self, key, v)
             return v
 
 
@@ -112,3 +114,119 @@ class Zipper:
         w = ZipperWrapper(name, r, self.bases)
         self._prev = w
         self.points.append(w)
+
+
+class GridZipper:
+    """Merges whole tracks at once on the union of their timestamps.
+
+    Every track contributes to the points it actually recorded, with its
+    own gaps filled by interpolation, and the result for each field is the
+    mean over the contributing tracks, like ZipperWrapper does per point.
+
+    With a rate, the merge is computed on a fixed grid of that many
+    seconds instead, aligned to whole multiples of it. A track contributes
+    to a grid point it has samples on both sides of, no more than
+    MAX_GAP seconds or the rate apart, whichever is longer, and grid
+    points no track contributes to are left out.
+    """
+    MAX_GAP = 10
+
+    def __init__(self, *tracks, rate=None):
+        self.rate = rate
+        self.tracks = []
+        for t in tracks:
+            if not isinstance(t, Columns):
+                t = Columns.from_records(getattr(t, 'name', None), t)
+            last = np.append(t.time[1:] != t.time[:-1], True)
+            self.tracks.append(t.select(last).interpolated())
+        self.merged = None
+
+    def merge(self):
+        if self.rate:
+            (axis, found, values) = self.resample()
+        else:
+            (axis, found, values) = self.union()
+
+        # A track joining after the start continues from the merged distance
+        dist = values['distance']
+        firsts = [ (np.argmax(found[k]), k) for k in range(len(self.tracks)) ]
+        for (first, k) in sorted(firsts):
+            if first == 0:
+                continue
+            base = self.mean(dist[:, first-1])
+            if not np.isnan(base):
+                dist[k] += base
+
+        fields = dict((key, self.mean(v)) for (key, v) in values.items())
+        tzinfo = self.tracks[0].tzinfo if self.tracks else None
+        self.merged = Columns("merged", axis, tzinfo=tzinfo, **fields)
+        self.found = found
+        return self.merged
+
+    def union(self):
+        axis = np.unique(np.concatenate([ t.time for t in self.tracks ]))
+        found = np.zeros((len(self.tracks), len(axis)), dtype=bool)
+        values = dict((key, np.full((len(self.tracks), len(axis)), np.nan))
+                      for key in FIELDS)
+        for (k, t) in enumerate(self.tracks):
+            idx = np.searchsorted(axis, t.time)
+            found[k, idx] = True
+            for key in FIELDS:
+                values[key][k, idx] = getattr(t, key)
+        return (axis, found, values)
+
+    def resample(self):
+        tracks = [ t for t in self.tracks if len(t) ]
+        if tracks:
+            start = math.ceil(min(t.time[0] for t in tracks) / self.rate) * self.rate
+            end = max(t.time[-1] for t in tracks)
+            axis = start + self.rate * np.arange(max(0, int((end - start) // self.rate) + 1))
+        else:
+            axis = np.zeros(0)
+        max_gap = max(self.MAX_GAP, self.rate)
+        found = np.zeros((len(self.tracks), len(axis)), dtype=bool)
+        values = dict((key, np.full((len(self.tracks), len(axis)), np.nan))
+                      for key in FIELDS)
+        for (k, t) in enumerate(self.tracks):
+            if not len(t):
+                continue
+            idx = np.searchsorted(t.time, axis)
+            inside = (idx > 0) & (idx < len(t))
+            after = t.time[np.minimum(idx, len(t) - 1)]
+            before = t.time[np.maximum(idx - 1, 0)]
+            found[k] = ((after == axis)
+                        | (inside & (after - before <= max_gap)))
+            for key in FIELDS:
+                values[key][k] = np.where(found[k],
+                                          np.interp(axis, t.time, getattr(t, key)),
+                                          np.nan)
+        # Grid points inside a gap of every track would have nothing but a time
+        keep = found.any(axis=0)
+        return (axis[keep], found[:, keep],
+                dict((key, v[:, keep]) for (key, v) in values.items()))
+
+    def mean(self, v):
+        valid = ~np.isnan(v)
+        total = np.where(valid, v, 0).sum(axis=0)
+        cnt = valid.sum(axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(cnt > 0, total / cnt, np.nan)
+
+    def columns(self):
+        if self.merged is None:
+            self.merge()
+        return self.merged
+
+    def all(self):
+        merged = self.columns()
+        names = [ t.name for t in self.tracks ]
+        for (r, found) in zip(merged.all(), self.found.T.tolist()):
+            r.name = "-".join(n if f else "NONE" for (n, f) in zip(names, found))
+            yield r
+
+    def __iter__(self):
+        self._g = self.all()
+        return self
+
+    def __next__(self):
+        return next(self._g)
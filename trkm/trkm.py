@@ -1,10 +1,8 @@
 
 import argparse
-import activityio as aio
 import sys, os
-import gpxpy, gpxpy.gpx
-from gpxpy import gpxfield
-from . import sequencer
+from .batch import Batch
+from .instrument import stats
 import math
 import datetime
 
@@ -21,46 +19,59 @@ class GPXWriter:
         self.multiplier = multiplier
 
     def write(self, output_file):
-        gpx = gpxpy.gpx.GPX()
-        gpx.creator = "TrackMerge"
-        trk = gpxpy.gpx.GPXTrack()
-        gpx.tracks.append(trk)
-        seg = gpxpy.gpx.GPXTrackSegment()
-        trk.segments.append(seg)
-
-        ptcnt = 0
-        for t in self.seq:
-            ptcnt += 1
-            if self.options.progress and ptcnt % 27 == 0:
-                print("\r%8d" % ptcnt, end="")
-                sys.stdout.flush()
-            ext = {}
-            lat = getattr(t, 'lat', None)
-            lon = getattr(t, 'lon', None)
-            alt = getattr(t, 'alt', None)
-            spd = getattr(t, 'speed', None)
-            if spd:
-                spd = spd * self.multiplier
-            pt = gpxpy.gpx.GPXTrackPoint(latitude=lat,
-                                         longitude=lon,
-                                         elevation=alt,
-                                         time=t.time,
-                                         speed=spd)
-            if t.hr != None:
-                ext['gpxtpx:hr'] = int(round(t.hr))
-            if t.cadence != None:
-                ext['gpxtpx:cad'] = int(round(t.cadence))
-            if t.temperature != None:
-                ext['gpxtpx:atemp'] = int(round(t.temperature))
-            if spd != None:
-                ext['gpxtpx:speed'] = spd
-            if ext:
-                pt.extensions = { 'gpxtpx:TrackPointExtension': self.dict_to_xml(ext) }
-            seg.points.append(pt)
+        with open(output_file, 'w', buffering=1024*1024) as f:
+            f.write(self.header())
+            ptcnt = 0
+            for t in self.seq:
+                ptcnt += 1
+                if self.options.progress and ptcnt % 27 == 0:
+                    print("\r%8d" % ptcnt, end="")
+                    sys.stdout.flush()
+                f.write(self.trkpt(t))
+            f.write("</trkseg></trk></gpx>\n")
         print("%8d" % ptcnt)
 
-        self.write_gpx(output_file, gpx)
-
+    def header(self):
+        v = '1/1'
+        xml_attributes = [
+            ('xmlns:xsi', 'http://www.w3.org/2001/XMLSchema-instance'),
+            ('xmlns', 'http://www.topografix.com/GPX/%s' % v),
+            ('xmlns:gpxtpx', 'http://www.garmin.com/xmlschemas/TrackPointExtension/v1'),
+            ('xsi:schemaLocation', 'http://www.topografix.com/GPX/%s http://www.topografix.com/GPX/%s/gpx.xsd' % (v, v)),
+            ('version', '1.1'),
+            ('creator', 'TrackMerge') ]
+        return ('<?xml version="1.0" encoding="UTF-8"?>\n<gpx %s>\n<trk>\n<trkseg>\n'
+                % " ".join('%s="%s"' % a for a in xml_attributes))
+
+    def trkpt(self, t):
+        ext = {}
+        lat = getattr(t, 'lat', None)
+        lon = getattr(t, 'lon', None)
+        alt = getattr(t, 'alt', None)
+        spd = getattr(t, 'speed', None)
+        if spd:
+            spd = spd * self.multiplier
+        if lat is not None and lon is not None:
+            r = '<trkpt lat="%s" lon="%s">\n' % (lat, lon)
+        else:
+            r = '<trkpt>\n'
+        if alt is not None:
+            r += '<ele>%s</ele>\n' % alt
+        if t.time is not None:
+            tm = t.time - (t.time.utcoffset() or datetime.timedelta())
+            r += '<time>%s</time>\n' % tm.strftime("%Y-%m-%dT%H:%M:%SZ")
+        if t.hr != None:
+            ext['gpxtpx:hr'] = int(round(t.hr))
+        if t.cadence != None:
+            ext['gpxtpx:cad'] = int(round(t.cadence))
+        if t.temperature != None:
+            ext['gpxtpx:atemp'] = int(round(t.temperature))
+        if spd != None:
+            ext['gpxtpx:speed'] = spd
+        if ext:
+            r += ('<extensions>\n<gpxtpx:TrackPointExtension>%s</gpxtpx:TrackPointExtension></extensions>'
+                  % self.dict_to_xml(ext))
+        return r + '</trkpt>\n'
 
     def dict_to_xml(self, tab):
         r = ""
@@ -75,25 +86,6 @@ class GPXWriter:
         return r
 
 
-    def write_gpx(self, output_file, gpx):
-        version='1.1'
-        v = '1/1'
-        xml_attributes = {
-            'xmlns:xsi': 'http://www.w3.org/2001/XMLSchema-instance',
-            'xmlns': 'http://www.topografix.com/GPX/%s' % v,
-            'xmlns:gpxtpx': 'http://www.garmin.com/xmlschemas/TrackPointExtension/v1',
-            'xsi:schemaLocation': 'http://www.topografix.com/GPX/%s http://www.topografix.com/GPX/%s/gpx.xsd' % (v, v) }
-        #gpxfield.GPXField('speed', type=gpxfield.FLOAT_TYPE) ]
-        content = gpxfield.gpx_fields_to_xml(gpx, 'gpx', version=version,
-                                             custom_attributes=xml_attributes)
-        xml = '<?xml version="1.0" encoding="UTF-8"?>\n' + content.strip() + "\n"
-
-        f = open(output_file, 'w')
-        f.write(xml)
-
-        f.close()
-
-
 class TCXWriter:
     def __init__(self, sequencer, options, multiplier=1):
         self.seq = sequencer
@@ -101,78 +93,103 @@ class TCXWriter:
         self.multiplier = multiplier
 
     def write(self, output_file):
-        tcx = None
-        lap = None
-        trk = None
-        start_time = None
-        end_time = None
         total_distance = 0
         max_speed = 0
-        prev_time = None
         ptcnt = 0
-        for t in self.seq:
-            if t.time is None:
-                continue
-            ptcnt += 1
-            if self.options.progress and ptcnt % 27 == 0:
-                #print("\r%8d - %8.2f" % (ptcnt, t.distance), end="")
-                print(t.time)
-                sys.stdout.flush()
-            if tcx is None:
-                (tcx, lap, trk) = self.setup_tcx(t.time)
-                start_time = t.time
-
-            prev_time = end_time
-            end_time = t.time
-            if t.distance:
-                total_distance = t.distance
-
-            trkpt = tcx.createElement("Trackpoint")
-            trk.appendChild(trkpt)
-            tm = t.time - (t.time.utcoffset() or datetime.timedelta())
-            self.add_text_elt(tcx, trkpt, "Time",
-                              tm.strftime("%Y-%m-%dT%H:%M:%SZ"))
-
-            lat = getattr(t, 'lat', None)
-            lon = getattr(t, 'lon', None)
-            alt = getattr(t, 'alt', None)
-            if lat and lon:
-                pos = tcx.createElement("Position")
-                self.add_text_elt(tcx, pos, "LatitudeDegrees", lat)
-                self.add_text_elt(tcx, pos, "LongitudeDegrees", lon)
-                trkpt.appendChild(pos)
-            if alt:
-                self.add_text_elt(tcx, trkpt, "AltitudeMeters", "55.8")
-
-
-            if t.hr != None:
-                hr = tcx.createElement("HeartRateBpm")
-                trkpt.appendChild(hr)
-                self.add_text_elt(tcx, hr, "Value", int(t.hr))
-            if t.cadence != None:
-                self.add_text_elt(tcx, trkpt, "Cadence", int(round(t.cadence)))
-            self.add_text_elt(tcx, trkpt,
-                              "DistanceMeters",
-                              "%.2f" % (total_distance * self.multiplier))
-
-            spd = getattr(t, 'speed', None)
-            if spd is not None:
-                max_speed = max(spd * self.multiplier, max_speed)
-                ext = tcx.createElement("Extensions")
-                trkpt.appendChild(ext)
-                tpx = tcx.createElement("TPX")
-                tpx.setAttribute("xmlns",
-                                 "http://www.garmin.com/xmlschemas/ActivityExtension/v2")
-                ext.appendChild(tpx)
-                self.add_text_elt(tcx, tpx, "Speed", round(spd, 1))
-                #       <Watts>0</Watts>
-
-
-        self.add_text_elt(tcx, lap, "DistanceMeters",
-                          "%.2f" % (total_distance * self.multiplier))
-        self.add_text_elt(tcx, lap, "Calories", 0)
-        self.add_text_elt(tcx, lap, "TriggerMethod", "Manual")
-        #self.add_text_elt(tcx, lap, "MaximumSpeed", max_speed)
+        with open(output_file, "wt", buffering=1024*1024) as f:
+            for t in self.seq:
+                if t.time is None:
+                    continue
+                ptcnt += 1
+                if self.options.progress and ptcnt % 27 == 0:
+                    #print("\r%8d - %8.2f" % (ptcnt, t.distance), end="")
+                    print(t.time)
+                    sys.stdout.flush()
+                if ptcnt == 1:
+                    f.write(self.header(t.time))
+
+                if t.distance:
+                    total_distance = t.distance
+                spd = getattr(t, 'speed', None)
+                if spd is not None:
+                    max_speed = max(spd * self.multiplier, max_speed)
+                f.write(self.trackpoint(t, total_distance))
+
+            if ptcnt:
+                f.write(self.footer(total_distance, max_speed))
+
+    def text_elt(self, indent, name, value):
+        return "%s<%s>%s</%s>\n" % (" " * indent, name, value, name)
+
+    def trackpoint(self, t, total_distance):
+        tm = t.time - (t.time.utcoffset() or datetime.timedelta())
+        r = "     <Trackpoint>\n"
+        r += self.text_elt(6, "Time", tm.strftime("%Y-%m-%dT%H:%M:%SZ"))
+
+        lat = getattr(t, 'lat', None)
+        lon = getattr(t, 'lon', None)
+        alt = getattr(t, 'alt', None)
+        if lat and lon:
+            r += "      <Position>\n"
+            r += self.text_elt(7, "LatitudeDegrees", lat)
+            r += self.text_elt(7, "LongitudeDegrees", lon)
+            r += "      </Position>\n"
+        if alt:
+            r += self.text_elt(6, "AltitudeMeters", "55.8")
+
+        if t.hr != None:
+            r += "      <HeartRateBpm>\n"
+            r += self.text_elt(7, "Value", int(t.hr))
+            r += "      </HeartRateBpm>\n"
+        if t.cadence != None:
+            r += self.text_elt(6, "Cadence", int(round(t.cadence)))
+        r += self.text_elt(6, "DistanceMeters",
+                           "%.2f" % (total_distance * self.multiplier))
+
+        spd = getattr(t, 'speed', None)
+        if spd is not None:
+            r += "      <Extensions>\n"
+            r += '       <TPX xmlns="http://www.garmin.com/xmlschemas/ActivityExtension/v2">\n'
+            r += self.text_elt(8, "Speed", round(spd, 1))
+            #       <Watts>0</Watts>
+            r += "       </TPX>\n"
+            r += "      </Extensions>\n"
+        return r + "     </Trackpoint>\n"
+
+    def header(self, start_time):
+        start_time -= start_time.utcoffset() or datetime.timedelta()
+        start_time_str = start_time.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+        root_attributes = [
+            ("xsi:schemaLocation",
+             "http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2 http://www.garmin.com/xmlschemas/TrainingCenterDatabasev2.xsd"),
+            ("xmlns:ns5",
+             "http://www.garmin.com/xmlschemas/ActivityGoals/v1"),
+            ("xmlns:ns3",
+             "http://www.garmin.com/xmlschemas/ActivityExtension/v2"),
+            ("xmlns:ns2",
+             "http://www.garmin.com/xmlschemas/UserProfile/v2"),
+            ("xmlns",
+             "http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2"),
+            ("xmlns:xsi",
+             "http://www.w3.org/2001/XMLSchema-instance") ]
+        r = '<?xml version="1.0" encoding="UTF-8"?>\n'
+        r += "<TrainingCenterDatabase %s>\n" % " ".join('%s="%s"' % a for a in root_attributes)
+        r += " <Activities>\n"
+        r += '  <Activity Sport="Biking">\n'
+        r += self.text_elt(3, "Id", start_time_str)
+        r += '   <Lap StartTime="%s">\n' % start_time_str
+        r += "    <Track>\n"
+        return r
+
+    def footer(self, total_distance, max_speed):
+        # The lap summary follows the track, so it needs no second pass
+        r = "    </Track>\n"
+        r += self.text_elt(4, "DistanceMeters",
+                           "%.2f" % (total_distance * self.multiplier))
+        r += self.text_elt(4, "Calories", 0)
+        r += self.text_elt(4, "TriggerMethod", "Manual")
+        #r += self.text_elt(4, "MaximumSpeed", max_speed)
         # <AverageHeartRateBpm>
         #  <Value>158</Value>
         # </AverageHeartRateBpm>
@@ -182,101 +199,38 @@ class TCXWriter:
         # <Intensity>Active</Intensity>
         # <Cadence>61</Cadence>
         # <TriggerMethod>Manual</TriggerMethod>
-        with open(output_file, "wt") as writer:
-            tcx.writexml(writer, newl="\n", addindent=" ", encoding="UTF-8")
-
-        # gpx.creator = "TrackMerge"
-        # trk = gpxpy.gpx.GPXTrack()
-        # gpx.tracks.append(trk)
-        # seg = gpxpy.gpx.GPXTrackSegment()
-        # trk.segments.append(seg)
-
-        # ptcnt = 0
-        # for t in self.zip:
-        #     ptcnt += 1
-        #     if ptcnt % 27 == 0:
-        #         print("\r%8d" % ptcnt, end="")
-        #         sys.stdout.flush()
-        #     ext = {}
-        #     lat = getattr(t, 'lat', None)
-        #     lon = getattr(t, 'lon', None)
-        #     alt = getattr(t, 'alt', None)
-        #     spd = getattr(t, 'speed', None)
-        #     if spd:
-        #         print(spd, spd * math.pi)
-        #         spd = spd * math.pi
-        #     pt = gpxpy.gpx.GPXTrackPoint(latitude=lat,
-        #                                  longitude=lon,
-        #                                  elevation=alt,
-        #                                  time=t.time,
-        #                                  speed=spd)
-        #     if t.hr != None:
-        #         ext['gpxtpx:hr'] = int(round(t.hr))
-        #     if t.cad != None:
-        #         ext['gpxtpx:cad'] = int(round(t.cad))
-        #     if t.temperature != None:
-        #         ext['gpxtpx:atemp'] = int(round(t.temperature))
-        #     if spd != None:
-        #         ext['gpxtpx:speed'] = spd
-        #     if ext:
-        #         pt.extensions = { 'gpxtpx:TrackPointExtension': self.dict_to_xml(ext) }
-        #     seg.points.append(pt)
-        # print("%8d" % ptcnt)
-
-        # self.write_gpx(output_file, gpx)
-
-    def add_text_elt(self, doc, parent, name, value):
-        elt = doc.createElement(name)
-        elt.appendChild(doc.createTextNode(str(value)))
-        parent.appendChild(elt)
-        return elt
-
-    def setup_tcx(self, start_time):
-        from xml.dom.minidom import Document
-        start_time -= start_time.utcoffset() or datetime.timedelta()
-        start_time_str = start_time.strftime("%Y-%m-%dT%H:%M:%SZ")
+        r += "   </Lap>\n"
+        r += "  </Activity>\n"
+        r += " </Activities>\n"
+        r += "</TrainingCenterDatabase>\n"
+        return r
+
+
+class TRKWriter:
+    """Writes the merged track as a memory mappable track file, which can
+    be read back as input without parsing anything.
+    """
+    def __init__(self, sequencer, options, multiplier=1):
+        self.seq = sequencer
+        self.options = options
+        self.multiplier = multiplier
 
-        tcx = Document()
-        root = tcx.createElement("TrainingCenterDatabase")
-        root.setAttribute(
-            "xsi:schemaLocation",
-            "http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2 http://www.garmin.com/xmlschemas/TrainingCenterDatabasev2.xsd")
-        root.setAttribute(
-            "xmlns:ns5",
-            "http://www.garmin.com/xmlschemas/ActivityGoals/v1")
-        root.setAttribute(
-            "xmlns:ns3",
-            "http://www.garmin.com/xmlschemas/ActivityExtension/v2")
-        root.setAttribute(
-            "xmlns:ns2",
-            "http://www.garmin.com/xmlschemas/UserProfile/v2")
-        root.setAttribute(
-            "xmlns",
-            "http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2")
-        root.setAttribute(
-            "xmlns:xsi",
-            "http://www.w3.org/2001/XMLSchema-instance")
-        # root.setAttribute("xmlns:ns2", "http://www.garmin.com/xmlschemas/UserProfile/v2")
-        # root.setAttribute("xmlns:ns3",
-        #                   "http://www.garmin.com/xmlschemas/ActivityExtension/v2")
-        # root.setAttribute("xmlns:ns5", "http://www.garmin.com/xmlm")
-        tcx.appendChild(root)
-        acts = tcx.createElement("Activities")
-        root.appendChild(acts)
-        act = tcx.createElement("Activity")
-        act.setAttribute("Sport", "Biking")
-        acts.appendChild(act)
-
-        self.add_text_elt(tcx, act, "Id", start_time_str)
-
-        lap = tcx.createElement("Lap")
-        lap.setAttribute("StartTime", start_time_str)
-        act.appendChild(lap)
-
-        trk = tcx.createElement("Track")
-        lap.appendChild(trk)
-
-        return (tcx, lap, trk)
+    def write(self, output_file):
+        from . import sequencer
+        if isinstance(self.seq, sequencer.Columns):
+            columns = self.seq
+        elif hasattr(self.seq, 'columns'):
+            columns = self.seq.columns()
+        else:
+            columns = sequencer.Columns.from_records("merged", self.seq)
+        if self.multiplier != 1:
+            fields = dict((key, getattr(columns, key))
+                          for key in sequencer.columns.FIELDS)
+            fields['speed'] = fields['speed'] * self.multiplier
+            fields['distance'] = fields['distance'] * self.multiplier
+            columns = sequencer.Columns(columns.name, columns.time,
+                                        tzinfo=columns.tzinfo, **fields)
+        sequencer.TrackFile.write(output_file, columns)
 
 
 class Options:
@@ -313,9 +267,18 @@ class Options:
 class TrackMerge:
 
     def main():
+        def rate(s):
+            try:
+                v = float(s[:-1] if s.endswith('s') else s)
+            except ValueError:
+                raise argparse.ArgumentTypeError("invalid rate '%s', expected "
+                                                 "seconds like 1s or 5s" % s)
+            if not v > 0:
+                raise argparse.ArgumentTypeError("rate must be positive")
+            return v
         parser = argparse.ArgumentParser(description="GPS track merge")
         parser.add_argument("-f", "--format", metavar="FORMAT",
-                            help="Output file format, may be GPX or TCX",
+                            help="Output file format, may be GPX, TCX or TRK",
                             dest="format", default="GPX")
         parser.add_argument("-m", "--multiplier", metavar="N",
                             help="Constant to multiply speed and distance values with, "
@@ -326,27 +289,75 @@ class TrackMerge:
                             help="Check and clean up common some data errors",
                             dest="cleanup", default=False, action="store_true")
         parser.add_argument("-o", "--cleanup-option", metavar="NAME=VALUE",
-                            help="Set cleanup options: MaxSpeed=<kmh>",
+                            help="Set cleanup options: MaxSpeed=<kmh>, Window=<points> "
+                            "to clean up while streaming through a window of that size",
                             dest="cleanup_opts", action="append")
+        parser.add_argument("-e", "--engine", metavar="ENGINE",
+                            help="Merge engine, may be 'zipper' (point by point) or "
+                            "'grid' (whole tracks at once, much faster on long tracks)",
+                            dest="engine", default="zipper", choices=["zipper", "grid"])
+        parser.add_argument("-r", "--rate", metavar="SECONDS", type=rate,
+                            help="Resample the merged track to one point every SECONDS, "
+                            "like 1s or 5s, instead of one per input timestamp; "
+                            "implies --engine grid",
+                            dest="rate", default=None)
+        parser.add_argument("-b", "--batch", metavar="MANIFEST",
+                            help="Run all merges listed in MANIFEST, one per line as "
+                            "OUTPUT TRACK..., in parallel",
+                            dest="batch", default=None)
+        parser.add_argument("-j", "--jobs", metavar="N", type=int,
+                            help="Number of worker processes for --batch, defaults to the "
+                            "number of CPUs; without --batch, parse the input files in "
+                            "this many processes",
+                            dest="jobs", default=None)
+        parser.add_argument("--no-cache",
+                            help="Parse every input file, bypassing the parsed track cache",
+                            dest="cache", default=True, action="store_false")
+        parser.add_argument("--cache-dir", metavar="DIR",
+                            help="Parsed track cache directory, defaults to ~/.cache/trkm",
+                            dest="cache_dir", default=None)
+        parser.add_argument("--cache-size", metavar="MB", type=int,
+                            help="Size limit of the parsed track cache, default 1024",
+                            dest="cache_size", default=1024)
         parser.add_argument("-v", "--verbose",
                             help="Show processing details",
                             dest="verbose", default=False, action="store_true")
         parser.add_argument("-p", "--progress",
                             help="Show progress info",
                             dest="progress", default=False, action="store_true")
+        parser.add_argument("--timings",
+                            help="Report how long imports and each stage took",
+                            dest="timings", default=False, action="store_true")
+        parser.add_argument("--stats", metavar="FILE",
+                            help="Write time, points in and out, peak memory and "
+                            "counters of each stage to FILE as JSON",
+                            dest="stats", default=None)
+        parser.add_argument("--profile", metavar="DIR",
+                            help="Profile each stage separately, writing a pstats "
+                            "file per stage into DIR",
+                            dest="profile", default=None)
         parser.add_argument("input_files", metavar="TRACK", nargs="*",
                             help="Input file to process. One of these formats: "
                             "Garmin TCX (.tcx), FIT or Flexible and Interoperable "
-                            "Data Transfer (.fit), or GPS Exchange Format (.gpx)")
-        parser.add_argument("output_file", metavar="OUTPUT.gpx",
+                            "Data Transfer (.fit), GPS Exchange Format (.gpx) or a track "
+                            "file written with --format TRK (.trk)")
+        parser.add_argument("output_file", metavar="OUTPUT.gpx", nargs="?",
                             help="The merged track is always in GPX format with "
                             "Garmin extensions")
 
         args = parser.parse_args()
+        if args.rate:
+            args.engine = "grid"
+        if args.output_file is None and args.input_files:
+            args.output_file = args.input_files.pop()
+        if args.output_file is None and not args.batch:
+            parser.error("the following arguments are required: OUTPUT.gpx")
         if args.format.upper() == "GPX":
             writer = GPXWriter
         elif args.format.upper() == "TCX":
             writer = TCXWriter
+        elif args.format.upper() == "TRK":
+            writer = TRKWriter
         else:
             raise Exception("Format '%s' not recognized" % args.format)
         if args.multiplier == "PI":
@@ -354,31 +365,118 @@ class TrackMerge:
         else:
             m = float(args.multiplier)
 
-        TrackMerge(args, m).merge(writer, args.output_file)
+        stats.enabled = bool(args.timings or args.stats or args.profile)
+        stats.profiling = bool(args.profile)
+        if args.batch:
+            with stats.stage("batch"):
+                failed = Batch(args, m, writer).run(args.batch)
+        else:
+            TrackMerge(args, m).merge(writer, args.output_file)
+            failed = 0
+        if args.timings:
+            stats.report()
+        if args.stats:
+            stats.write(args.stats)
+        if args.profile:
+            stats.dump_profiles(args.profile)
+        if failed:
+            sys.exit(1)
 
 
     def __init__(self, options, multiplier=1):
+        # Deferred until here, so that --help and argument errors do not
+        # pay for numpy and the readers
+        with stats.stage("import sequencer"):
+            from . import sequencer
         self.sequencers = []
+        self.interpolators = []
         self.options = options
         self.multiplier = multiplier
-        for file_name in self.options.input_files:
-            if os.path.splitext(file_name)[1] == '.ini':
-                seq = sequencer.Faker(file_name)
+        if self.options.cache:
+            self.cache = sequencer.Cache(self.options.cache_dir,
+                                         self.options.cache_size * 1024 * 1024)
+        else:
+            self.cache = None
+        with stats.stage("read") as st:
+            tracks = self.read(self.options.input_files)
+            st.points_out = sum(len(t) for t in tracks
+                                if isinstance(t, sequencer.Columns))
+            if self.cache:
+                st.counters['cache_hits'] = self.cache.hits
+                st.counters['cache_misses'] = self.cache.misses
+        with stats.stage("merge") as st:
+            for seq in tracks:
+                if self.options.engine == "grid":
+                    self.sequencers.append(seq)
+                else:
+                    ip = sequencer.Interpolator(seq)
+                    self.interpolators.append(ip)
+                    self.sequencers.append(stats.timed("interpolator", ip))
+            if self.options.engine == "grid":
+                self.seq = sequencer.GridZipper(*self.sequencers, rate=self.options.rate)
+                self.seq.merge()
+                st.points_in = sum(len(t) for t in self.seq.tracks)
+                st.points_out = len(self.seq.merged)
+                self.seq = stats.probe("zipper", self.seq)
             else:
-                data = aio.read(file_name)
-                seq = sequencer.AIO(file_name, data)
-            ipt = sequencer.Interpolator(seq)
-            self.sequencers.append(ipt)
-        self.seq = sequencer.Zipper(*self.sequencers)
+                # Merges lazily, the work shows up under the zipper and
+                # interpolator stages
+                self.seq = stats.probe("zipper", sequencer.Zipper(*self.sequencers),
+                                       fields=sequencer.FIELDS)
         if options.cleanup:
             if self.options.verbose:
                 cleanup_opts = Options(self.options.cleanup_opts + ["verbose=1"])
             else:
                 cleanup_opts = Options(self.options.cleanup_opts)
-            self.seq = sequencer.Cleanup(self.seq, cleanup_opts)
-
+            self.seq = stats.probe("cleanup", sequencer.Cleanup(self.seq, cleanup_opts))
+
+
+    def read(self, file_names):
+        """Returns a sequencer for every input, parsing the track files in
+        --jobs worker processes when asked to.
+        """
+        from . import sequencer
+        files = [ f for f in file_names if os.path.splitext(f)[1] != '.ini' ]
+        # Mapped track files are cheaper to open here than to send back
+        parse = [ f for f in files if os.path.splitext(f)[1].lower() != '.trk' ]
+        tracks = {}
+        if self.options.jobs and self.options.jobs > 1 and len(parse) > 1:
+            import concurrent.futures
+            with concurrent.futures.ProcessPoolExecutor(max_workers=self.options.jobs) as pool:
+                tracks.update(zip(parse, pool.map(sequencer.read, parse,
+                                                  [self.cache] * len(parse))))
+        for f in files:
+            if f not in tracks:
+                tracks[f] = sequencer.read(f, self.cache)
+        result = []
+        for f in file_names:
+            if f in tracks:
+                result.append(tracks[f])
+            else:
+                # A ride description stands for all its devices
+                result.extend(sequencer.Faker(f).devices())
+        return result
 
     def merge(self, writer, output_file=None):
         if not output_file:
             output_file = self.options.output_file
-        writer(self.seq, self.options, multiplier=self.multiplier).write(output_file)
+        with stats.stage("write"):
+            writer(self.seq, self.options, multiplier=self.multiplier).write(output_file)
+        self.collect_stats()
+
+    def collect_stats(self):
+        """Fills in the stage counters only known once everything ran."""
+        if not stats.enabled:
+            return
+        if self.interpolators:
+            st = stats.get("interpolator")
+            st.points_in = sum(ip.loaded for ip in self.interpolators)
+            st.points_out = sum(len(ip.points) for ip in self.interpolators)
+            st.counters['inserted'] = sum(ip.inserted for ip in self.interpolators)
+            st.counters['interpolated'] = sum(ip.interpolated for ip in self.interpolators)
+        # Each stage takes in what the one before it put out
+        names = ("merge" if self.options.engine == "grid" else "interpolator",
+                 "zipper", "cleanup", "write")
+        stages = [ stats.stages[name] for name in names if name in stats.stages ]
+        for (prev, st) in zip(stages, stages[1:]):
+            st.points_in = prev.points_out